@@ -1,10 +1,17 @@
-from qiskit import ClassicalRegister
-from qiskit import QuantumRegister
-from qiskit import QuantumCircuit 
-from qiskit import transpile
-from qiskit_aer import Aer
+from functools import lru_cache
+from statistics import NormalDist
 import numpy as np
 import argparse
+import json
+import Exact
+import Cache
+import Noise
+import Counts
+import Timing
+import Mitigation
+import Statistics
+import Autotune
+import Recording
 
 ########################################
 #   Violation of the CHSH inequality   #
@@ -37,14 +44,8 @@ import argparse
 # The qubit will stay in this superposition until it is measured, then it will collapse into either 0 or 1.
 
 
-# Defines qubits as q, and creates 2 of them. They can be called with q[0] or q[1]
-# by default, these qubits start in the |0> state.
-q = QuantumRegister(2,'q')
-
-
-# Defines classiacl bits as c, and creates 2 of them. They can be called with c[0] or c[1]
-# These bits are used to store the information after the collapse of the qubits. 
-c = ClassicalRegister(2,'c')
+# Qiskit takes a few seconds to import, so it is only imported inside the functions that use it.
+# That way other programs can import this one (i.e. just for expectation()) without waiting for it.
 
 
 
@@ -59,6 +60,16 @@ c = ClassicalRegister(2,'c')
 
 # Function to return a quantum circuit with 2 entangled qubits
 def bell():
+    from qiskit import ClassicalRegister, QuantumRegister, QuantumCircuit
+
+    # Defines qubits as q, and creates 2 of them. They can be called with q[0] or q[1]
+    # by default, these qubits start in the |0> state.
+    q = QuantumRegister(2,'q')
+
+    # Defines classiacl bits as c, and creates 2 of them. They can be called with c[0] or c[1]
+    # These bits are used to store the information after the collapse of the qubits. 
+    c = ClassicalRegister(2,'c')
+
     # Creates a quantum circuit with 2 qubits and 2 classical bits
     qc = QuantumCircuit(q, c)  
 
@@ -153,96 +164,716 @@ def expectation(counts):
 # Note that due to the absolute value, the bound −2 ≤ S is also valid, but S ≥ 2 is more commonly used
 
 
-def CHSH(shots):
-    backend = Aer.get_backend('qasm_simulator')  # Use the Aer simulator instead of queueing to IBM
+# Define angles for measurements
+# These angles are derived from the geometry of the Bloch sphere and maximize the violation of the CHSH inequality
+angles = {
+    'A0': np.pi / 2,   # A_1 = np.pi / 2  Measure in the X-basis
+    'A1': 0,           # A_0 = 0          Measure in the Z-basis 
+    'B0': np.pi / 4,   # B_0 = np.pi / 4  Measure at pi/4 from the Z-axis
+    'B1': -np.pi / 4   # B_1 = -np.pi / 4 Measure at -pi/4 from the Z-axis
+}
 
-    # Initialize the CHSH value, S
-    S = 0  
 
-    # Define angles for measurements
-    # These angles are derived from the geometry of the Bloch sphere and maximize the violation of the CHSH inequality
-    angles = {
-        'A0': np.pi / 2,   # A_1 = np.pi / 2  Measure in the X-basis
-        'A1': 0,           # A_0 = 0          Measure in the Z-basis 
-        'B0': np.pi / 4,   # B_0 = np.pi / 4  Measure at pi/4 from the Z-axis
-        'B1': -np.pi / 4   # B_1 = -np.pi / 4 Measure at -pi/4 from the Z-axis
-    }
-    
 
+# Define each measurement setting to be looped over
+# This could be with a more compact for i,j loop, but this is easier to see what's happening
+measurement_settings = [
+    ('A0', 'B0'),    
+    ('A0', 'B1'),
+    ('A1', 'B0'),
+    ('A1', 'B1'),
+]
 
-    # Define each measurement setting to be looped over
-    # This could be with a more compact for i,j loop, but this is easier to see what's happening
-    measurement_settings = [
-        ('A0', 'B0'),    
-        ('A0', 'B1'),
-        ('A1', 'B0'),
-        ('A1', 'B1'),
-    ]
+# The sign of each setting in S = E(A_0 B_0) - E(A_0 B_1) + E(A_1 B_0) + E(A_1 B_1)
+# in the same order as measurement_settings
+signs = np.array([1, -1, 1, 1])
 
-    # Recall that Alice is A_0, A_1 and Bob is B_0, B_1
-    for alice, bob in measurement_settings:
 
-        # Create the Bell state with 2 entangled particles, Alice and Bob
-        qc = bell()
+# Function to build one measured circuit per measurement setting
+# The circuits come back in the same order as measurement_settings
+# report is an optional Timing.Report that the time spent on each circuit is added to
+def circuits(report=None):
 
-        # Apply Alice's A0 and A1 measurements on the 0th qubit and store it in the 0th bit for each measurement setting
-        qc = measure(qc, angles[alice], 0, 0)
+    qcs = []
 
-        # Apply Bob's B0 and B1 measurements on the 1st qubit and store it in the 1st bit for each measurement setting
-        qc = measure(qc, angles[bob], 1, 1)
+    # Recall that Alice is A_0, A_1 and Bob is B_0, B_1
+    for alice, bob in measurement_settings:
+        with Timing.phase(report, 'build', alice + bob):
 
-        # Transpile and run the circuit through qiskit and the Aer simulator backend
-        transpiled_qc = transpile(qc, backend)
-        job = backend.run(transpiled_qc, shots=shots) 
-        # shots=1000000 is for the iterations for the expectation values, higher shots improve statistical significance
-        result = job.result()
-        counts = result.get_counts()
-        # stores each count for the expectation values for each measurement setting
+            # Create the Bell state with 2 entangled particles, Alice and Bob
+            qc = bell()
 
-        # Calculate the expectation value for each measurement setting
-        E = expectation(counts)
+            # Apply Alice's A0 and A1 measurements on the 0th qubit and store it in the 0th bit for each measurement setting
+            qc = measure(qc, angles[alice], 0, 0)
 
-        ## UNCOMMENT ME!
-        ## print(f"E({alice}{bob}) = {E:.4f}, Counts: {counts}")
-        # outputs the individual expectation values for each measurement setting
+            # Apply Bob's B0 and B1 measurements on the 1st qubit and store it in the 1st bit for each measurement setting
+            qc = measure(qc, angles[bob], 1, 1)
 
         ## UNCOMMENT ME!
         ## print(qc.draw())
         # draws the quantum circuits for each expectation value
 
-        # Add or subtract the expectation value based on the CHSH formula
-        # S = E(A_0 B_0) - E(A_0 B_1) + E(A_1 B_0) + E(A_1 B_1)
-        if alice == 'A0' and bob == 'B1':  
-            S -= E # Subtract E(A_0 B_1)
-        else:  
-            S += E # Add E(A_0 B_0), E(A_1 B_1), E(A_1 B_0)
+        qcs.append(qc)
+
+    return qcs
+
+
+# Function to draw the counts for every measurement setting without running the simulator
+# For 2 qubits the outcome distribution is known exactly (see Exact.py), so the counts
+# can be drawn from it directly. One multinomial draw replaces all of the shots, so this
+# takes the same time for 2^10 shots as for 2^29 shots.
+# With a noise model (see Noise.py) the counts are drawn from the exact noisy probabilities instead
+def sample(shots, seed=None, noise=None, report=None):
+
+    # seed makes the draws repeatable, None draws fresh randomness every time
+    rng = np.random.default_rng(seed)
+
+    # Exact outcome probabilities for each setting, shape (4 settings, 4 outcomes)
+    with Timing.phase(report, 'probabilities'):
+        probs = probabilities(noise)
+
+    # Renormalize so rounding errors can't push the total probability above 1
+    probs = probs / probs.sum(axis=-1, keepdims=True)
+
+    # Draws the number of 00, 01, 10, 11 outcomes for all four settings at once
+    with Timing.phase(report, 'sample'):
+        draws = rng.multinomial(shots, probs)
+
+    # Convert back into the same dicts Aer returns
+    # Outcome i is the bitstring of i, e.g. 2 -> '10' (c[1] = 1, c[0] = 0)
+    return Counts.to_dicts(draws)
+
+
+# Function to return the exact outcome probabilities of every measurement setting
+# The output has shape (4 settings, 4 outcomes), ordered like measurement_settings and |00>, |01>, |10>, |11>
+# Without noise they come from Exact.py, with noise from one density matrix run (see Noise.py)
+def probabilities(noise=None):
+
+    if noise:
+        return Noise.probabilities(circuits(), noise)
+
+    alice_angles = [angles[alice] for alice, bob in measurement_settings]
+    bob_angles = [angles[bob] for alice, bob in measurement_settings]
+    return Exact.probabilities(alice_angles, bob_angles)
+
+
+# Function to return the exact S, the value the sampled S approaches as the shots go to infinity
+# mitigate=True undoes the readout error first (see Mitigation.py), so only the gate noise is left
+def exact(noise=None, mitigate=False):
+    probs = probabilities(noise)
+    if mitigate:
+        probs = Mitigation.correct(probs, Mitigation.matrix(noise))
+    E = Exact.expectation(probs)
+    return E @ signs
+
+
+# Aer options that only change how fast a run is, not its result
+# These are left out of the cache key so a run can be reused with different thread settings
+speed_options = ('max_parallel_threads', 'max_parallel_experiments', 'max_parallel_shots')
+
+
+# Function to return everything that decides the result of a run
+# This is what the results are cached under, see Cache.py
+def config(shots, sampler=False, seed=None, noise=None, pairs=None, batched=True, **options):
+    entry = {
+        'shots': shots,
+        'seed': seed,
+        'angles': {name: float(angle) for name, angle in angles.items()},
+        'settings': measurement_settings,
+        'backend': 'sampler' if sampler else 'qasm_simulator',
+        'noise': noise,
+        'options': {name: value for name, value in options.items() if name not in speed_options},
+    }
+
+    # Packed runs are only different from normal runs when simulated shot by shot
+    if pairs and not sampler:
+        entry['pairs'] = pairs
+
+    # One job per setting draws different counts for the same seed than one batched job
+    if not (batched or sampler or pairs):
+        entry['batched'] = False
+
+    return entry
+
+
+# Function to return the counts for every measurement setting, in the order of measurement_settings
+# batched=True sends all four circuits to the simulator as one multi-experiment job
+# batched=False runs the settings one after another, one job each (the original behaviour)
+# sampler=True skips the simulator and draws the counts with sample()
+# seed makes the shots repeatable for both the simulator and the sampler
+# cache=True reuses the counts of an identical earlier seeded run, see Cache.py
+# noise adds a noise model to the simulator or sampler, i.e. noise={'depolarizing': 0.01}, see Noise.py
+# report is an optional Timing.Report that the time spent in each phase is added to
+# pairs runs every setting on that many Bell pairs side by side in one circuit, see packed()
+# autotune=True uses the fastest thread settings found for this machine by Autotune.py, if it's
+#   been tuned (any option given here wins over the tuned ones). They never change the counts.
+# Any other keyword, e.g. max_parallel_threads=2, is passed on to the Aer simulator
+def run(shots, batched=True, sampler=False, seed=None, cache=True, noise=None, report=None, pairs=None,
+        autotune=True, **options):
+
+    tuned = Autotune.best(shots) if autotune and not (sampler or pairs) else None
+    if tuned is not None:
+        options = {**tuned['options'], **options}
+
+    # Unseeded runs are random every time, so only seeded runs are cached
+    cache = cache and seed is not None
+
+    if cache:
+        with Timing.phase(report, 'cache'):
+            entry = Cache.load(config(shots, sampler, seed, noise, pairs, batched, **options))
+        if entry is not None:
+            return entry['counts']
+
+    counts_list = simulate(shots, batched, sampler, seed, noise, report, pairs, **options)
+
+    if cache:
+        with Timing.phase(report, 'cache'):
+            Cache.store(config(shots, sampler, seed, noise, pairs, batched, **options), counts_list, S_value(counts_list))
+
+    return counts_list
+
+
+# Function that does the work of run(), without the cache
+def simulate(shots, batched=True, sampler=False, seed=None, noise=None, report=None, pairs=None, **options):
+
+    if sampler:
+        return sample(shots, seed, noise, report)
+
+    if pairs:
+        return packed(shots, pairs, seed, noise, report, **options)
+
+    from qiskit import transpile
+    from qiskit_aer import Aer
+
+    if noise:
+        backend = Noise.simulator(noise)  # Aer simulator with a noise model
+    else:
+        backend = Aer.get_backend('qasm_simulator')  # Use the Aer simulator instead of queueing to IBM
+
+    # Aer only takes a seed if there is one
+    # A batched job seeds every experiment differently from seed_simulator by itself
+    if seed is not None and batched:
+        options['seed_simulator'] = seed
+
+    qcs = circuits(report)
+
+    # The name of each setting for the report, i.e. 'A0B1'
+    names = [alice + bob for alice, bob in measurement_settings]
+
+    if batched:
+        # Transpile all of the circuits in one call and run them as a single job
+        # max_parallel_experiments=0 lets Aer run the experiments side by side on every available core
+        options.setdefault('max_parallel_experiments', 0)
+        with Timing.phase(report, 'transpile'):
+            transpiled_qcs = transpile(qcs, backend)
+        with Timing.phase(report, 'run'):
+            job = backend.run(transpiled_qcs, shots=shots, **options)
+            result = job.result()
+
+        # A multi-experiment result holds one counts dict per circuit, in submission order
+        counts_list = []
+        for i, name in enumerate(names):
+            with Timing.phase(report, 'get_counts', name):
+                counts_list.append(result.get_counts(i))
+
+    else:
+        # Separate jobs need a seed each, one seed for all four would give every setting the same
+        #   random draws, and the settings wouldn't be independent anymore (see Counts.standard_error)
+        if seed is None:
+            seeds = [None] * len(qcs)
+        else:
+            seeds = [int(child.generate_state(1)[0]) for child in np.random.SeedSequence(seed).spawn(len(qcs))]
+
+        counts_list = []
+        for qc, name, setting_seed in zip(qcs, names, seeds):
+            setting_options = options if setting_seed is None else {**options, 'seed_simulator': setting_seed}
+
+            # Transpile and run the circuit through qiskit and the Aer simulator backend
+            with Timing.phase(report, 'transpile', name):
+                transpiled_qc = transpile(qc, backend)
+            with Timing.phase(report, 'run', name):
+                job = backend.run(transpiled_qc, shots=shots, **setting_options)
+                result = job.result()
+            with Timing.phase(report, 'get_counts', name):
+                counts_list.append(result.get_counts())
+
+    return counts_list
+
+
+# Function to combine the counts of the four settings into S
+# counts_list is ordered like measurement_settings
+def S_value(counts_list, report=None):
+
+    # S = E(A_0 B_0) - E(A_0 B_1) + E(A_1 B_0) + E(A_1 B_1)
+    # Counts.S calculates all four expectation values and adds them with their signs in one go
+    with Timing.phase(report, 'expectation'):
+        E = Counts.expectation(Counts.to_array(counts_list))
+
+    ## UNCOMMENT ME!
+    ## for (alice, bob), E_i, counts in zip(measurement_settings, E, counts_list): print(f"E({alice}{bob}) = {E_i:.4f}, Counts: {counts}")
+    # outputs the individual expectation values for each measurement setting
+
+    return float(E @ signs)
+
+
+# report=True also returns a timing report of the run as a dictionary, see Timing.py
+#   (the return value is then (S, report) instead of just S)
+# profile=True and memory=True add cProfile and tracemalloc results to that report
+# mitigate=True undoes the readout error of the noise model before calculating S, see Mitigation.py
+# pairs runs every setting on that many Bell pairs in one wide circuit, see packed()
+def CHSH(shots, batched=True, sampler=False, seed=None, cache=True, noise=None,
+         report=False, profile=False, memory=False, mitigate=False, pairs=None, **options):
+
+    timing = Timing.Report(profile, memory) if (report or profile or memory) else None
+    if timing is not None:
+        timing.start()
+
+    # shots=1000000 is for the iterations for the expectation values, higher shots improve statistical significance
+    counts_list = run(shots, batched=batched, sampler=sampler, seed=seed, cache=cache, noise=noise,
+                      report=timing, pairs=pairs, **options)
+
+    if mitigate:
+        with Timing.phase(timing, 'mitigate'):
+            S = float(Mitigation.S(Counts.to_array(counts_list), noise))
+    else:
+        S = S_value(counts_list, timing)
+
+    if timing is not None:
+        timing.stop()
+        return S, timing.to_dict()
 
     return S
     # return the CHSH value
     # The theorhetical maximum violation that can be obtained is S = 2√2 (Tsirelson's bound)
     # When using the Aer simulator on lower shot counts, it will occasionally be slightly over this bound.
     
+
+####################
+#   Packed Pairs   #
+####################
+
+
+# The four settings don't have to be four circuits. Bell pairs that never interact are independent,
+#   so one wide circuit can hold a pair for every setting, and every shot of it measures all four.
+# With several pairs per setting, every shot gives several samples of every setting,
+#   so the same number of samples needs that many times fewer shots.
+#
+# Pair k is qubits 2k (Alice) and 2k+1 (Bob), measured into bits 2k and 2k+1,
+#   and it is given setting k % 4 of measurement_settings.
+# Up to 2 pairs per setting (16 qubits) Aer's default method samples the shots fastest.
+# Wider circuits are simulated with the matrix product state method, which is fast because
+#   the pairs are never entangled with each other, but every shot then costs more to sample,
+#   so in simulation 2 pairs per setting is usually the sweet spot. On hardware more is better.
+
+# Function to return one circuit with pairs_per_setting Bell pairs for every measurement setting
+def packed_circuit(pairs_per_setting=1):
+    from qiskit import QuantumCircuit
+
+    pairs = pairs_per_setting * len(measurement_settings)
+    qc = QuantumCircuit(2 * pairs, 2 * pairs)
+
+    for k in range(pairs):
+        alice, bob = measurement_settings[k % len(measurement_settings)]
+
+        # The same Bell state as bell(), on this pair's qubits
+        qc.h(2 * k)
+        qc.cx(2 * k, 2 * k + 1)
+
+        qc = measure(qc, angles[alice], 2 * k, 2 * k)
+        qc = measure(qc, angles[bob], 2 * k + 1, 2 * k + 1)
+
+    return qc
+
+
+# Function to return the counts for every measurement setting from one packed circuit
+# Every setting gets at least shots samples, rounded up to a whole number of circuit shots
+# The matrix product state method simulates at most 63 qubits, so pairs_per_setting can be up to 7
+def packed(shots, pairs_per_setting=2, seed=None, noise=None, report=None, **options):
+    from qiskit import transpile
+    from qiskit_aer import AerSimulator
+
+    if seed is not None:
+        options['seed_simulator'] = seed
+
+    # The method is given to the simulator itself, because it decides how many qubits the simulator allows
+    pairs = pairs_per_setting * len(measurement_settings)
+    method = options.pop('method', 'automatic' if pairs <= 8 else 'matrix_product_state')
+    backend = Noise.simulator(noise, method=method) if noise else AerSimulator(method=method)
+
+    with Timing.phase(report, 'build'):
+        qc = packed_circuit(pairs_per_setting)
+    with Timing.phase(report, 'transpile'):
+        transpiled_qc = transpile(qc, backend)
+    with Timing.phase(report, 'run'):
+        result = backend.run(transpiled_qc, shots=-(-shots // pairs_per_setting), **options).result()
+
+    # The counts of every pair, then every setting's pairs added together
+    with Timing.phase(report, 'get_counts'):
+        per_pair = Counts.marginals(result.get_counts(), pairs)
+        per_setting = per_pair.reshape(pairs_per_setting, len(measurement_settings), 4).sum(axis=0)
+
+    return Counts.to_dicts(per_setting)
+
+
+#################
+#   Streaming   #
+#################
+
+
+# Every shot is either +1 (agree) or -1 (disagree), so a single shot has variance 1 - E^2
+# and the average of N shots has variance (1 - E^2)/N.
+# The four settings are independent, so their variances add up to the variance of S.
+
+# Function to return the standard error of S from the counts of each setting
+def standard_error(counts_list):
+    return float(Counts.standard_error(Counts.to_array(counts_list)))
+
+
+# Function to run shots in chunks instead of all at once
+# After every chunk it yields (shots so far, S, standard error of S)
+# It stops once the confidence interval is narrower than ±target, or after max_shots
+#   (with neither, it keeps going until the caller stops asking)
+# mitigate=True undoes the readout error (see Mitigation.py), and the error and stopping point
+#   then come from the mitigated S, which needs more shots for the same precision
+#
+# i.e.
+#   for shots, S, error in stream(target=1e-4):
+#       print(shots, S, error)
+def stream(target=None, chunk=1048576, max_shots=None, confidence=0.95,
+           sampler=False, seed=None, mitigate=False, **options):
+
+    # z is how many standard errors wide the confidence interval is, 1.96 for 95%
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+
+    # Every chunk gets its own seed from this sequence so the chunks are independent
+    # but the whole stream is still repeatable for a fixed seed
+    seed_sequence = np.random.SeedSequence(seed)
+
+    # Without a seed the chunk seeds are new every time, so caching the chunks would only fill the cache
+    cache = options.pop('cache', True) and seed is not None
+
+    # The running counts for each setting, as a (4 settings, 4 outcomes) array (see Counts.py)
+    totals = np.zeros((len(measurement_settings), 4), dtype=np.int64)
+    shots = 0
+
+    # The readout error is only calibrated once for the whole stream
+    M = Mitigation.matrix(options.get('noise')) if mitigate else None
+
+    while max_shots is None or shots < max_shots:
+
+        # The last chunk is shortened so we don't go past max_shots
+        size = chunk if max_shots is None else min(chunk, max_shots - shots)
+        chunk_seed = int(seed_sequence.spawn(1)[0].generate_state(1)[0])
+
+        # Add the new counts onto the running counts
+        totals += Counts.to_array(run(size, sampler=sampler, seed=chunk_seed, cache=cache, **options))
+        shots += size
+
+        if mitigate:
+            error = float(Mitigation.standard_error(totals, M))
+            yield shots, float(Counts.S(Mitigation.correct(totals, M))), error
+        else:
+            error = float(Counts.standard_error(totals))
+            yield shots, float(Counts.S(totals)), error
+
+        if target is not None and z * error <= target:
+            return
+
+
+####################
+#   Angle Sweeps   #
+####################
+
+
+# The fixed angles above are only one point in the space of measurement settings.
+# To map E and S over many angles, the circuit is built once with symbolic angles
+# (Parameters) and transpiled once. The simulator then substitutes every (a, b) pair itself.
+
+# Function to return Alice's and Bob's measurement angles as symbols
+# lru_cache means every call returns the same two symbols
+@lru_cache(maxsize=None)
+def parameters():
+    from qiskit.circuit import Parameter
+    return Parameter('alpha'), Parameter('beta')
+
+
+# Function to return the transpiled, parameterized CHSH circuit
+# lru_cache means the circuit is only built and transpiled the first time it is asked for
+@lru_cache(maxsize=None)
+def template():
+    from qiskit import transpile
+    from qiskit_aer import Aer
+
+    backend = Aer.get_backend('qasm_simulator')
+    alpha, beta = parameters()
+
+    qc = bell()
+    qc = measure(qc, alpha, 0, 0)
+    qc = measure(qc, beta, 1, 1)
+
+    return transpile(qc, backend)
+
+
+# Function to calculate E(a, b) for arrays of Alice's and Bob's angles
+# alice_angles and bob_angles are broadcast against each other, the result has the broadcast shape
+def correlators(alice_angles, bob_angles, shots=1048576):
+    from qiskit_aer import Aer
+
+    backend = Aer.get_backend('qasm_simulator')
+    alpha, beta = parameters()
+
+    a, b = np.broadcast_arrays(np.asarray(alice_angles, dtype=float),
+                               np.asarray(bob_angles, dtype=float))
+
+    # parameter_binds gives Aer every value of every parameter in one submission
+    # so there is only one job no matter how many angle pairs there are
+    binds = [{alpha: a.ravel().tolist(), beta: b.ravel().tolist()}]
+    job = backend.run(template(), shots=shots, parameter_binds=binds, max_parallel_experiments=0)
+    counts = job.result().get_counts()
+
+    # A single experiment returns a dict instead of a list of dicts
+    if isinstance(counts, dict):
+        counts = [counts]
+
+    E = Counts.expectation(Counts.to_array(counts))
+    return E.reshape(a.shape)
+
+
+# Function to calculate the four correlators and S for arrays of all four angles
+# i.e. angle_sweep(A0, A1, B0, B1) where each argument is a number or an array
+# Returns E with a trailing axis of 4 (ordered like measurement_settings) and S
+def angle_sweep(A0, A1, B0, B1, shots=1048576):
+
+    A0, A1, B0, B1 = np.broadcast_arrays(*[np.asarray(x, dtype=float) for x in (A0, A1, B0, B1)])
+
+    # Pair the angles up in the same order as measurement_settings
+    alice_angles = np.stack([A0, A0, A1, A1], axis=-1)
+    bob_angles = np.stack([B0, B1, B0, B1], axis=-1)
+
+    E = correlators(alice_angles, bob_angles, shots)
+    S = E @ signs
+
+    return E, S
+
+
+####################
+#   Optimization   #
+####################
+
+
+# With noise, the angles at the top of this program may no longer give the largest S.
+# Exact.optimize() finds the best angles from the 3x3 correlation matrix K of the noisy state,
+#   which only takes the exact probabilities at 9 settings, one density matrix run (see Exact.py).
+#
+# K assumes the gate noise is the same at every angle, but the transpiler drops RY(0) and RY(π)
+#   together with their noise, so the model can be a little off for angles like those.
+#   That's why the angles it finds are checked with exact() before they're used.
+
+# Function to return K for the Bell state with a noise model
+def correlations(noise=None):
+
+    if not noise:
+        return Exact.state_correlations()[0]
+
+    qcs = []
+    for alice in Exact.tomography_angles:
+        for bob in Exact.tomography_angles:
+            qc = bell()
+            qc = measure(qc, alice, 0, 0)
+            qc = measure(qc, bob, 1, 1)
+            qcs.append(qc)
+
+    E = Exact.expectation(Noise.probabilities(qcs, noise)).reshape(3, 3)
+    return Exact.correlation_matrix(E)
+
+
+# Function to return the exact S with other angles, see exact()
+# The angles are only changed for this one calculation
+def exact_with(new_angles, noise=None):
+    saved = dict(angles)
+    angles.update({name: new_angles[name] for name in angles})
+    try:
+        return exact(noise)
+    finally:
+        angles.update(saved)
+
+
+# Function to return the angles that give the largest S with a noise model, and that S
+# The current angles are one of the starting points, and the angles found are only returned if
+#   their exact S (from one density matrix run) is larger than that of the current ones,
+#   so they are never worse. S is always the exact S of the returned angles.
+# prepare=True also optimizes the state cos θ|00> + sin θ|11> that is measured,
+#   which is only worked out for the depolarizing and readout noise models, and S is then the model's
+# Any other keyword, i.e. restarts=256, is passed on to Exact.optimize()
+def optimize(noise=None, prepare=False, **options):
+    options.setdefault('start', angles)
+
+    if prepare:
+        if noise and 'backend' in noise:
+            raise ValueError("prepare=True only works with depolarizing and readout noise")
+        noise = noise or {}
+        return Exact.optimize(depolarizing=noise.get('depolarizing', 0), readout=noise.get('readout', 0),
+                              prepare=True, **options)
+
+    best = Exact.optimize(correlations(noise), **options)
+    best['S'] = exact_with(best, noise)
+
+    # Angles that are only better by rounding error aren't worth changing to
+    current = exact(noise)
+    if best['S'] <= current + 1e-9:
+        return {**{name: float(angle) for name, angle in angles.items()}, 'S': current}
+    return best
+
+
 # This big code block just lets me pass shots through the command line
 # i.e. python Aer_Qasm.py --shots 100000
-parser = argparse.ArgumentParser(
+# The arguments are added by a function so chsh.py can reuse them for its qasm command
+def add_arguments(parser):
+    parser.add_argument(
+        "--shots", "-s",
+        type=int,
+        default=1048576, #2^20
+        help="Number of measurement shots to run (default: 2^20)"
+    )
+    parser.add_argument(
+        "--sampler",
+        action="store_true",
+        help="Draw the counts from the exact probabilities instead of running the simulator"
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="Seed for the simulator or sampler, for repeatable results"
+    )
+    parser.add_argument(
+        "--precision", "-p",
+        type=float,
+        default=None,
+        help="Run shots in chunks of --shots until S is known to within ±precision (95%% confidence)"
+    )
+    parser.add_argument(
+        "--noise", "-n",
+        type=Noise.parse,
+        default=None,
+        help="Noise model, i.e. depolarizing=0.01,readout=0.02 or backend=FakeSherbrooke (default: none)"
+    )
+    parser.add_argument(
+        "--report",
+        action="store_true",
+        help="Print how long each phase of the run took, as JSON"
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Add cProfile and tracemalloc results to the --report"
+    )
+    parser.add_argument(
+        "--exact",
+        action="store_true",
+        help="Print the exact S from the density matrix instead of running shots"
+    )
+    parser.add_argument(
+        "--mitigate",
+        action="store_true",
+        help="Undo the readout error of the --noise model before calculating S"
+    )
+    parser.add_argument(
+        "--bootstrap", "-b",
+        type=int,
+        default=None,
+        metavar="RESAMPLES",
+        help="Print the standard error, confidence intervals and p-value of S against 2, "
+             "with RESAMPLES bootstrap resamples (see Statistics.py)"
+    )
+    parser.add_argument(
+        "--optimize",
+        action="store_true",
+        help="Find the angles that maximize S with the --noise model and run with those instead"
+    )
+    parser.add_argument(
+        "--prepare",
+        action="store_true",
+        help="With --optimize, also print the best state cos θ|00> + sin θ|11> to measure"
+    )
+    parser.add_argument(
+        "--pairs",
+        type=int,
+        default=None,
+        help="Run all four settings in one circuit, with this many Bell pairs per setting"
+    )
+    parser.add_argument(
+        "--record",
+        default=None,
+        metavar="DIRECTORY",
+        help="Keep every single outcome, packed 4 shots to a byte, in DIRECTORY (see Recording.py)"
+    )
+    return parser
+
+
+parser = add_arguments(argparse.ArgumentParser(
     description="Compute the CHSH value with a user-specified number of shots"
-)
-parser.add_argument(
-    "--shots", "-s",
-    type=int,
-    default=1048576, #2^20
-    help="Number of measurement shots to run (default: 2^20)"
-)
-args = parser.parse_args()
+))
+
+
+# Run the experiment with already parsed arguments
+def command(args):
+
+    if args.optimize:
+        best = optimize(args.noise, seed=args.seed)
+
+        if all(best[name] == angles[name] for name in angles):
+            print(f"The current angles already give the largest S found = {best['S']:.10f}...")
+        else:
+            print("Best angles: " + ", ".join(f"{name} = {best[name]:.6f}" for name in angles))
+            print(f"Largest S found = {best['S']:.10f}... (exact)")
+
+            # Every circuit from here on uses the new angles
+            for name in angles:
+                angles[name] = best[name]
+
+        if args.prepare:
+            prepared = optimize(args.noise, prepare=True, seed=args.seed)
+            print(f"Largest S found with θ = {prepared['theta']:.6f} = {prepared['S']:.10f}... (model)")
+
+    if args.exact:
+        S = exact(args.noise, args.mitigate)
+    elif args.record is not None:
+        S = Counts.S(Recording.record(args.record, args.shots, args.sampler, args.seed, args.noise))
+        print(f"Every outcome is saved in {args.record}, "
+              f"see python Recording.py windows {args.record} --window SHOTS")
+    elif args.precision is not None:
+        # Print the running value after every chunk
+        for shots, S, error in stream(target=args.precision, chunk=args.shots,
+                                      sampler=args.sampler, seed=args.seed, noise=args.noise,
+                                      mitigate=args.mitigate):
+            print(f"{shots = }; S = {S:.10f} ± {error:.2e}")
+    elif args.bootstrap is not None:
+        counts_list = run(args.shots, sampler=args.sampler, seed=args.seed, noise=args.noise, pairs=args.pairs)
+        summary = Statistics.summary(Counts.to_array(counts_list), resamples=args.bootstrap, seed=args.seed)
+        print(json.dumps(summary, indent=2))
+        S = summary['S']
+    elif args.report or args.profile:
+        S, report = CHSH(args.shots, sampler=args.sampler, seed=args.seed, noise=args.noise,
+                         report=True, profile=args.profile, memory=args.profile, mitigate=args.mitigate,
+                         pairs=args.pairs)
+        print(json.dumps(report, indent=2))
+    else:
+        S = CHSH(args.shots, sampler=args.sampler, seed=args.seed, noise=args.noise, mitigate=args.mitigate,
+                 pairs=args.pairs)
 
-# Run the experiment
-def main():
-    S = CHSH(args.shots)
     print(f"CHSH value:")
     print(f"S   = {S:.10f}...")
     print(f"2√2 = {2*np.sqrt(2):.10f}...")
 
 
+# Run the experiment
+# The arguments are only read here, so other programs can import CHSH without
+#   this parser trying to read their command line arguments
+def main(argv=None):
+    command(parser.parse_args(argv))
+
+
 ##################
 #   Conclusion   #
 ##################
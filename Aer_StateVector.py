@@ -1,6 +1,7 @@
-from qiskit import QuantumCircuit, transpile
-from qiskit_aer import Aer
+from functools import lru_cache
+import argparse
 import numpy as np
+import Exact
 
 # This suite of programs uses the IBM Qiskit Software Development Kit (SDK)
 # This particular program uses the Aer Statevector simulator
@@ -8,7 +9,11 @@ import numpy as np
 # This is a noiseless backend. 
 # It will manipulate qubits in a pure mathematical sense
 # While useful, it is not indicative of a real experimental environment
-backend = Aer.get_backend('statevector_simulator')
+# It is only loaded the first time it is needed, so importing this program is instant
+@lru_cache(maxsize=None)
+def backend():
+    from qiskit_aer import Aer
+    return Aer.get_backend('statevector_simulator')
     
 # These are the angles at which we're measuring our qubits
 angles = {
@@ -35,7 +40,65 @@ measurement_settings = [
     ('A1', 'B1'), # Add
 ]
 
-def CHSH():
+# Function to return the outcome probabilities |00>, |01>, |10>, |11> for one measurement setting
+def probabilities(alice, bob):
+    from qiskit import QuantumCircuit, transpile
+
+    # Note for the Statevector simulator: 
+    # We do not need classical bits to hold the results
+
+    # Create a circuit with 2 qubits
+    qc = QuantumCircuit(2)
+    
+    # First, we need to create Bell state between Alice and Bob
+    # Put a Hadamard gate on Alice (Qubit 0)
+    qc.h(0)    
+    # Then, put a CNOT gate on Alice and Bob (Controlled by Alice)  
+    qc.cx(0, 1)
+    
+    # Apply rotations to the qubits to align the measurement basis
+    qc.ry(-angles[alice], 0)  # Alice's basis
+    qc.ry(-angles[bob], 1)    # Bob's basis
+    
+    # Simulate to get the statevector
+    transpiled_qc = transpile(qc, backend())
+    result = backend().run(transpiled_qc).result()
+    statevector = result.get_statevector()
+    
+    # Calculate probabilities by squaring the probability amplitude
+    return np.abs(statevector)**2
+
+
+# Function to return the probabilities of all four settings from a single simulation
+# Every setting gets its own Bell pair in one 8-qubit circuit, pair k is qubits 2k (Alice) and 2k+1 (Bob)
+# The output has shape (4 settings, 4 outcomes), the same as Exact.probabilities
+def packed_probabilities():
+    from qiskit import QuantumCircuit, transpile
+
+    qc = QuantumCircuit(2 * len(measurement_settings))
+    for k, (alice, bob) in enumerate(measurement_settings):
+        qc.h(2 * k)
+        qc.cx(2 * k, 2 * k + 1)
+        qc.ry(-angles[alice], 2 * k)
+        qc.ry(-angles[bob], 2 * k + 1)
+
+    transpiled_qc = transpile(qc, backend())
+    statevector = backend().run(transpiled_qc).result().get_statevector()
+    probs = np.abs(statevector)**2
+
+    # Qiskit puts qubit 0 in the lowest bit, so in a (4, 4, 4, 4) array the last axis is pair 0
+    # and each axis is that pair's outcome |00>, |01>, |10>, |11>
+    probs = probs.reshape([4] * len(measurement_settings))
+
+    # The probabilities of one pair are the sum over the outcomes of every other pair
+    pairs = len(measurement_settings)
+    return np.array([probs.sum(axis=tuple(axis for axis in range(pairs) if axis != pairs - 1 - k))
+                     for k in range(pairs)])
+
+
+# The noiseless probabilities are known in closed form (see Exact.py), so by default they're
+#   calculated with NumPy. simulate=True runs the statevector simulator for every setting instead.
+def CHSH(simulate=False):
 
     # Initialize the CHSH Parameter
     S = 0
@@ -44,29 +107,10 @@ def CHSH():
     # We need to use both qubits, which we've named Alice and Bob
     for alice, bob in measurement_settings:
 
-        # Note for the Statevector simulator: 
-        # We do not need classical bits to hold the results
-
-        # Create a circuit with 2 qubits
-        qc = QuantumCircuit(2)
-        
-        # First, we need to create Bell state between Alice and Bob
-        # Put a Hadamard gate on Alice (Qubit 0)
-        qc.h(0)    
-        # Then, put a CNOT gate on Alice and Bob (Controlled by Alice)  
-        qc.cx(0, 1)
-        
-        # Apply rotations to the qubits to align the measurement basis
-        qc.ry(-angles[alice], 0)  # Alice's basis
-        qc.ry(-angles[bob], 1)    # Bob's basis
-        
-        # Simulate to get the statevector
-        transpiled_qc = transpile(qc, backend)
-        result = backend.run(transpiled_qc).result()
-        statevector = result.get_statevector()
-        
-        # Calculate probabilities by squaring the probability amplitude
-        probs = np.abs(statevector)**2
+        if simulate:
+            probs = probabilities(alice, bob)
+        else:
+            probs = Exact.probabilities(angles[alice], angles[bob])
         
         # Extract probabilities for each outcome
         prob_00 = probs[0]  # |00>
@@ -91,10 +135,54 @@ def CHSH():
 
     return S
 
-print("Calculating individual expectation values:")
-# Run the statevector simulation
-S_exact = CHSH()
 
-print(f"\nCalculating CHSH Value:")
-print(f"S   = {S_exact:.10f}...")
-print(f"2√2 = {2*np.sqrt(2):.10f}...")
+# Function to check the closed-form NumPy engine in Exact.py against the simulator
+# Every outcome probability of every measurement setting has to agree
+def crosscheck():
+    for alice, bob in measurement_settings:
+        simulated = probabilities(alice, bob)
+        exact = Exact.probabilities(angles[alice], angles[bob])
+        if not np.allclose(simulated, exact):
+            return False
+
+    # The packed circuit has to give the same probabilities as the four separate ones
+    exact = Exact.probabilities([angles[alice] for alice, bob in measurement_settings],
+                                [angles[bob] for alice, bob in measurement_settings])
+    return bool(np.allclose(packed_probabilities(), exact))
+
+
+# The arguments are added by a function so chsh.py can reuse them for its statevector command
+def add_arguments(parser):
+    parser.add_argument(
+        "--crosscheck",
+        action="store_true",
+        help="Also run the statevector simulator and check that it agrees with the NumPy engine"
+    )
+    return parser
+
+
+parser = add_arguments(argparse.ArgumentParser(
+    description="Compute the noiseless CHSH value"
+))
+
+
+# Run the calculation with already parsed arguments
+def command(args):
+    print("Calculating individual expectation values:")
+    S_exact = CHSH()
+
+    print(f"\nCalculating CHSH Value:")
+    print(f"S   = {S_exact:.10f}...")
+    print(f"2√2 = {2*np.sqrt(2):.10f}...")
+
+    if args.crosscheck:
+        print(f"NumPy engine and packed circuit agree with the simulator: {crosscheck()}")
+
+
+def main(argv=None):
+    command(parser.parse_args(argv))
+
+
+# Only run the simulation when this program is run directly, not when it's imported
+if __name__=="__main__":
+    main()
@@ -0,0 +1,157 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import time
+import Cache
+
+# This program finds the fastest way to run the Qasm simulator on this machine.
+#
+# How fast Aer runs the CHSH circuits depends on the machine (cores, memory, CPU) and on the
+#   number of shots: a few shots are fastest on one thread, billions of shots want every core.
+# So every candidate configuration is timed at a typical shot count of each range of shot counts,
+#   and the fastest one of each range is saved, per machine. To keep that short, every candidate
+#   is first timed once at 1/16 of the shots, and only the fastest few are timed properly.
+# From then on Aer_Qasm.run() uses the saved configuration for that range automatically
+#   (options passed to run() still win).
+#
+#   python Autotune.py            time the candidates and save the best ones
+#   python Autotune.py --show     print what's saved for this machine
+#
+# Only options that change how fast a run is, not its result, are tuned (see Aer_Qasm.speed_options).
+
+
+# Where the best configurations are kept, for every machine that's been tuned
+# It's in its own folder so Cache.evict() never deletes it to make room for results
+tuning_path = Cache.cache_dir / "autotune" / "tunings.json"
+
+# The ranges of shot counts, as (largest exponent in the range, exponent it's timed at)
+# i.e. every run up to 2^16 shots uses the configuration that was fastest at 2^14 shots
+ranges = [(16, 14), (22, 19), (None, 22)]
+
+
+# Function to return a name for this machine
+# Machines with the same name are assumed to be the same kind of machine
+def machine():
+    from qiskit_aer import __version__ as aer_version
+    return f"{platform.node()}|{platform.machine()}|{os.cpu_count()} cores|aer {aer_version}"
+
+
+# Function to return every configuration worth timing
+# Only thread settings are tried: Aer gives the same counts for a seed with any of them, so a
+#   tuned machine gives the same results as any other. The simulation method, fusion, and
+#   batched or not all change which counts a seed draws, so they aren't tuned.
+def candidates():
+    cores = os.cpu_count() or 1
+    threads = sorted({1, max(1, cores // 2), cores})
+
+    result = []
+    for thread_count, parallel_shots in itertools.product(threads, [1, 0]):
+        result.append({
+            'options': {
+                'max_parallel_threads': thread_count,
+                # 0 lets Aer split the shots over as many threads as it likes
+                'max_parallel_shots': parallel_shots,
+            },
+        })
+    return result
+
+
+# Function to return how long one run with a configuration takes, the best of repeat tries
+def time_run(shots, configuration, repeat=3):
+    import Aer_Qasm
+
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        Aer_Qasm.simulate(shots, seed=i, **configuration['options'])
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+# Function to time every configuration at a shot count, fastest first
+def ranking(shots, configurations, repeat):
+    timings = []
+    for configuration in configurations:
+        seconds = time_run(shots, configuration, repeat)
+        timings.append((seconds, configuration))
+        print(f"{shots:>10} shots  {seconds:10.4f} s  {configuration['options']}")
+    return sorted(timings, key=lambda timing: timing[0])
+
+
+# Function to time every candidate for every range and save the fastest ones for this machine
+# max_exponent caps the shot count anything is timed at, to keep tuning short
+# keep is how many of the fastest candidates of the quick first round are timed again properly
+def tune(repeat=3, max_exponent=22, keep=4):
+    results = []
+    for largest, exponent in ranges:
+        shots = 2**min(exponent, max_exponent)
+
+        quick = ranking(max(1024, shots // 16), candidates(), 1)
+        final = ranking(shots, [configuration for seconds, configuration in quick[:keep]], repeat)
+
+        seconds, best = final[0]
+        results.append({'max_exponent': largest, 'seconds': seconds, **best})
+
+    save(results)
+    return results
+
+
+# Function to save the best configurations of this machine, keeping the ones of other machines
+def save(results):
+    tunings = load_all()
+    tunings[machine()] = results
+    Cache.write_atomic(tuning_path, json.dumps(tunings, indent=2).encode())
+
+
+def load_all():
+    try:
+        with open(tuning_path) as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+# Function to return the saved configuration of this machine for a shot count,
+#   or None if this machine hasn't been tuned
+def best(shots):
+    results = load_all().get(machine())
+    if not results:
+        return None
+
+    for result in results:
+        if result['max_exponent'] is None or shots <= 2**result['max_exponent']:
+            return result
+    return results[-1]
+
+
+parser = argparse.ArgumentParser(
+    description="Find the fastest Aer settings for the CHSH circuits on this machine"
+)
+parser.add_argument("--repeat", "-r", type=int, default=3,
+                    help="Times every configuration is run, the fastest counts (default: 3)")
+parser.add_argument("--max-exponent", type=int, default=22,
+                    help="Largest shot count to time at is 2^this (default: 22)")
+parser.add_argument("--keep", "-k", type=int, default=4,
+                    help="Fastest configurations of the quick round to time again (default: 4)")
+parser.add_argument("--show", action="store_true",
+                    help="Print the saved configurations of this machine instead of tuning")
+
+
+def main(argv=None):
+    args = parser.parse_args(argv)
+
+    if args.show:
+        results = load_all().get(machine())
+        print(json.dumps(results, indent=2) if results else f"{machine()} hasn't been tuned yet")
+        return
+
+    for result in tune(args.repeat, args.max_exponent, args.keep):
+        limit = "any" if result['max_exponent'] is None else f"up to 2^{result['max_exponent']}"
+        print(f"Best for {limit} shots: {result['options']}")
+    print(f"Saved to {tuning_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import numpy as np
+
+# This program times every part of the CHSH pipeline so changes can be checked for speed.
+#
+#   python Benchmarks.py run --output before.json
+#   ... change something ...
+#   python Benchmarks.py run --output after.json
+#   python Benchmarks.py compare before.json after.json
+#
+# Every benchmark is run for each of its parameters (i.e. shot counts or data sizes).
+# Each measurement calls the function `number` times and is repeated `repeat` times,
+#   and the median is what gets compared, because it is the least sensitive to a busy machine.
+
+
+##################
+#   Benchmarks   #
+##################
+
+# Each benchmark is a function that takes one parameter and returns the function to time.
+# Any setup is done before returning, so it isn't part of the time.
+
+def statevector(param):
+    import Aer_StateVector
+
+    def function():
+        # Aer_StateVector.CHSH prints every expectation value, which isn't what we're timing
+        # simulate=True times the statevector simulator, not the NumPy engine it uses by default
+        with contextlib.redirect_stdout(io.StringIO()):
+            Aer_StateVector.CHSH(simulate=True)
+    return function
+
+
+def qasm(exponent):
+    import Aer_Qasm
+
+    # cache=False so every call actually runs the simulator
+    return lambda: Aer_Qasm.CHSH(2**exponent, seed=1, cache=False)
+
+
+def qasm_sampler(exponent):
+    import Aer_Qasm
+    return lambda: Aer_Qasm.CHSH(2**exponent, sampler=True, seed=1, cache=False)
+
+
+def expectation(param):
+    import Aer_Qasm
+    counts = {'00': 426791, '01': 73453, '10': 73167, '11': 426589}
+    return lambda: Aer_Qasm.expectation(counts)
+
+
+def transpilation(param):
+    from qiskit import transpile
+    from qiskit_aer import Aer
+    import Aer_Qasm
+
+    backend = Aer.get_backend('qasm_simulator')
+    return lambda: transpile(Aer_Qasm.circuits(), backend)
+
+
+def plotter(points):
+    import GSPlotter as gsp
+
+    x = np.arange(points)
+    y = np.random.default_rng(1).normal(2.8284271247, 0.001, points)
+
+    def function():
+        gsp.plotter(x_values=[x], y_values=[y], plot_labels=["S"], title="Benchmark",
+                    filename="benchmark.png")
+
+        # plotter() leaves its figure open, close it so the figures don't pile up
+        import matplotlib.pyplot as plt
+        plt.close("all")
+    return function
+
+
+# name: (function, parameters, number of calls per measurement)
+benchmarks = {
+    "statevector": (statevector, [None], 1),
+    "qasm": (qasm, list(range(10, 30)), 1),
+    "qasm_sampler": (qasm_sampler, list(range(10, 30)), 10),
+    "expectation": (expectation, [None], 10000),
+    "transpilation": (transpilation, [None], 10),
+    "plotter": (plotter, [10**2, 10**3, 10**4, 10**5, 10**6], 1),
+}
+
+
+###############
+#   Running   #
+###############
+
+# Function to time one benchmark at one parameter
+# Returns the seconds per call of every repeat
+def measure(function, number, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        times.append((time.perf_counter() - start) / number)
+    return times
+
+
+# Function to run the benchmarks whose names contain `select` (all of them by default)
+# max_exponent leaves out the qasm shot counts above 2^max_exponent
+def run(select="", repeat=5, max_exponent=29):
+
+    results = {}
+
+    # plotter() saves into ./plots, so run everything from a temporary folder
+    # (the cache is still the one in this folder, Cache.cache_dir is an absolute path)
+    here = os.getcwd()
+    sys.path.insert(0, here)
+    with tempfile.TemporaryDirectory() as folder:
+        os.chdir(folder)
+        try:
+            for name, (setup, params, number) in benchmarks.items():
+                if select not in name:
+                    continue
+
+                for param in params:
+                    if name.startswith("qasm") and param > max_exponent:
+                        continue
+
+                    function = setup(param)
+
+                    # One untimed call so imports and caches don't count
+                    function()
+
+                    times = measure(function, number, repeat)
+                    key = name if param is None else f"{name}[{param}]"
+                    results[key] = {
+                        "median": statistics.median(times),
+                        "min": min(times),
+                        "mean": statistics.mean(times),
+                        "times": times,
+                        "number": number,
+                    }
+                    print(f"{key:24} {results[key]['median']:.6e} s")
+        finally:
+            os.chdir(here)
+
+    return {
+        "machine": {
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cores": os.cpu_count(),
+            "python": platform.python_version(),
+        },
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "results": results,
+    }
+
+
+# Function to compare two saved runs
+# A benchmark is flagged when its median changed by more than threshold (0.1 = 10%)
+# Returns the names of the benchmarks that got slower
+def compare(old, new, threshold=0.1):
+
+    regressions = []
+    for key in old["results"]:
+        if key not in new["results"]:
+            continue
+
+        before = old["results"][key]["median"]
+        after = new["results"][key]["median"]
+        ratio = after / before
+
+        if ratio > 1 + threshold:
+            flag = "SLOWER"
+            regressions.append(key)
+        elif ratio < 1 - threshold:
+            flag = "faster"
+        else:
+            flag = ""
+
+        print(f"{key:24} {before:.6e} s -> {after:.6e} s  ({ratio:6.2f}x) {flag}")
+
+    if old["machine"] != new["machine"]:
+        print("Note: the two runs were made on different machines")
+
+    return regressions
+
+
+parser = argparse.ArgumentParser(
+    description="Benchmark the CHSH simulations and plotter"
+)
+commands = parser.add_subparsers(dest="command", required=True)
+
+run_parser = commands.add_parser("run", help="Run the benchmarks and save the results")
+run_parser.add_argument("--output", "-o", default="benchmarks.json",
+                        help="JSON file to save the results to (default: benchmarks.json)")
+run_parser.add_argument("--select", "-k", default="",
+                        help="Only run the benchmarks whose names contain this")
+run_parser.add_argument("--repeat", "-r", type=int, default=5,
+                        help="Number of measurements per benchmark (default: 5)")
+run_parser.add_argument("--max-exponent", type=int, default=29,
+                        help="Largest shot count to run the qasm benchmarks at, as a power of 2 (default: 29)")
+
+compare_parser = commands.add_parser("compare", help="Compare two saved results")
+compare_parser.add_argument("old", help="The results from before")
+compare_parser.add_argument("new", help="The results from after")
+compare_parser.add_argument("--threshold", "-t", type=float, default=0.1,
+                            help="Relative change that counts as slower or faster (default: 0.1)")
+
+
+def main(argv=None):
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        data = run(args.select, args.repeat, args.max_exponent)
+        with open(args.output, "w") as file:
+            json.dump(data, file, indent=2)
+        print(f"Saved to {args.output}")
+
+    else:
+        with open(args.old) as file:
+            old = json.load(file)
+        with open(args.new) as file:
+            new = json.load(file)
+
+        regressions = compare(old, new, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} benchmark(s) got slower")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
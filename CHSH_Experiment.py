@@ -1,10 +1,12 @@
-from qiskit import QuantumCircuit
-from qiskit.circuit import Parameter
-from qiskit.quantum_info import SparsePauliOp
-from qiskit_ibm_runtime import QiskitRuntimeService
-from qiskit_ibm_runtime import EstimatorV2 as Estimator
-from qiskit.transpiler.preset_passmanagers import generate_preset_pass_manager
 import numpy as np
+import argparse
+import asyncio
+from pathlib import Path
+import Cache
+
+# Qiskit and the IBM runtime take a while to import, and connecting to IBM Quantum
+#   saves credentials and talks to the network, so none of it happens on import.
+# Everything is done inside functions, and only main() actually runs the experiment.
 
 
 #############################
@@ -14,127 +16,491 @@ import numpy as np
 # Setting up the service to connect to IBM Quantum to submit the job to the queue
 token = 'YOUR_TOKEN_HERE'
 
-# Save credentials to disk for future sessions
-# Note: overwrite=True ensures previous credentials are replaced
-QiskitRuntimeService.save_account(
-   token=token,
-   # Specifies the IBM Quantum channel instead of using IBM Cloud
-   channel="ibm_quantum", 
-   overwrite=True  
-)
-
-# Initialize service using saved credentials
-service = QiskitRuntimeService(channel="ibm_quantum")
-
-# Select backend with these properties:
-# simulator=False: Ensures real hardware is used
-# operational=True: Only considers online systems
-# min_num_qubits=127: Filters for modern "Eagle" processor-based systems
-try:
-   backend = service.least_busy(simulator=False,
-                                operational=True,
-                                min_num_qubits=127)
-except:
-   print("No backend available. Using simulator instead.")
-   backend = service.get_backend("ibmq_qasm_simulator")
-
-print(f"Using backend: {backend.name}")
+
+# Function to save credentials and connect to IBM Quantum
+def connect(token=token):
+   from qiskit_ibm_runtime import QiskitRuntimeService
+
+   # Save credentials to disk for future sessions
+   # They only need saving once, so this is skipped if the same token is already saved
+   # Note: overwrite=True ensures previous credentials are replaced
+   saved = QiskitRuntimeService.saved_accounts(channel="ibm_quantum")
+   if not any(account.get("token") == token for account in saved.values()):
+      QiskitRuntimeService.save_account(
+         token=token,
+         # Specifies the IBM Quantum channel instead of using IBM Cloud
+         channel="ibm_quantum",
+         overwrite=True
+      )
+
+   # Initialize service using saved credentials
+   return QiskitRuntimeService(channel="ibm_quantum")
+
+
+# Function to pick the backend to run on
+# name picks a specific device (i.e. ibm_sherbrooke), which skips searching for the least busy one
+def select_backend(service, name=None):
+
+   if name is not None:
+      backend = service.backend(name)
+      print(f"Using backend: {backend.name}")
+      return backend
+
+   # Select backend with these properties:
+   # simulator=False: Ensures real hardware is used
+   # operational=True: Only considers online systems
+   # min_num_qubits=127: Filters for modern "Eagle" processor-based systems
+   try:
+      backend = service.least_busy(simulator=False,
+                                   operational=True,
+                                   min_num_qubits=127)
+   except:
+      print("No backend available. Using simulator instead.")
+      backend = service.get_backend("ibmq_qasm_simulator")
+
+   print(f"Using backend: {backend.name}")
+   return backend
+
 
 #############################
 #        CHSH  Setup        #
 #############################
 
 
-# Create a parameterized rotation angle 
-# (LaTeX formatted s.t. it appears as θ in circuit diagrams)
-theta = Parameter("$\\theta$")
+# Function to return the parameterized CHSH circuit
+def circuit():
+   from qiskit import QuantumCircuit
+   from qiskit.circuit import Parameter
+
+   # Create a parameterized rotation angle
+   # (LaTeX formatted s.t. it appears as θ in circuit diagrams)
+   theta = Parameter("$\\theta$")
+
+   # creates a quantum circuit with 2 qubits
+   qc = QuantumCircuit(2)
+
+   # Prepares the bell state to entangle the 2 qubits
+
+   # apply hadamard gate to qubit 0
+   qc.h(0)
+   # apply cnot gate to qubit 0, controlled by qubit 1
+   qc.cx(0, 1)
 
-# creates a quantum circuit with 2 qubits
-qc = QuantumCircuit(2)
+   # rotates the qubit about the y axis with the parameter theta
+   qc.ry(theta, 0)
 
-# Prepares the bell state to entangle the 2 qubits
+   return qc
 
-# apply hadamard gate to qubit 0
-qc.h(0)
-# apply cnot gate to qubit 0, controlled by qubit 1
-qc.cx(0, 1)
 
-# rotates the qubit about the y axis with the parameter theta
-qc.ry(theta, 0)
+# Function to return the phases theta is set to
+def phases(number_of_phases=20):
 
+   # Spaces out 40 different values between 0 and 2pi (full rotation)
+   # number_of_phases: Consider this to be the "resolution" of the parameterization
+   phases = np.linspace(0, 2 * np.pi, number_of_phases)
 
-# Spaces out 40 different values between 0 and 2pi (full rotation)
-number_of_phases = 20 # Consider this to be the "resolution" of the parameterization
-phases = np.linspace(0, 2 * np.pi, number_of_phases)
+   # Phases need to be expressed as list of lists in order to work
+   # (Note: A list of lists is a Pythonic way to express a matrix)
+   return [[angle] for angle in phases]
 
 
-# Phases need to be expressed as list of lists in order to work 
-# (Note: A list of lists is a Pythonic way to express a matrix)
-individual_phases = [[angle] for angle in phases]
+# Function to return the CHSH observable
+def observable():
+   from qiskit.quantum_info import SparsePauliOp
 
-# S = <ZZ> - <ZX> + <XZ> + <XX>
-# These are the Pauli X and Z gates tensored together
-observable = SparsePauliOp.from_list([
-   ("ZZ", 1),  # E(A_0 B_0)
-   ("ZX", -1), # - E(A_0 B_1)
-   ("XZ", 1),  # E(A_1 B_0)
-   ("XX", 1)   # E(A_1 B_1)
-])
+   # S = <ZZ> - <ZX> + <XZ> + <XX>
+   # These are the Pauli X and Z gates tensored together
+   return SparsePauliOp.from_list([
+      ("ZZ", 1),  # E(A_0 B_0)
+      ("ZX", -1), # - E(A_0 B_1)
+      ("XZ", 1),  # E(A_1 B_0)
+      ("XX", 1)   # E(A_1 B_1)
+   ])
+
+
+# The device has far more qubits than the 2 the circuit uses, so several Bell pairs can run
+#   side by side in one circuit. Every shot then measures every pair, which gives that many
+#   more samples per shot. Pair k is qubits 2k and 2k+1, and they all share the same theta.
+
+# Function to return a circuit with the CHSH circuit repeated on pairs Bell pairs
+def packed_circuit(pairs):
+   from qiskit import QuantumCircuit
+
+   single = circuit()
+   qc = QuantumCircuit(2 * pairs)
+   for k in range(pairs):
+      qc.compose(single, qubits=[2 * k, 2 * k + 1], inplace=True)
+   return qc
+
+
+# Function to return the S observable of every pair on its own ("S0", "S1", ...),
+#   and "S", the average over all of the pairs
+def packed_observables(pairs):
+   from qiskit.quantum_info import SparsePauliOp
+
+   terms = observable().to_list()
+   measured = {}
+   for k in range(pairs):
+      # The last character of a Pauli label is the lowest qubit, so Bob's qubit comes first
+      measured[f"S{k}"] = SparsePauliOp.from_sparse_list(
+         [(label, [2 * k + 1, 2 * k], coeff) for label, coeff in terms],
+         num_qubits=2 * pairs
+      )
+
+   measured["S"] = sum(measured.values()) / pairs
+   return measured
 
 
 #############################
 #       Backend Setup       #
 #############################
 
-# This is a critical step and is needed to collect the 
-#     properties of the specific backend
-target = backend.target
+# Function to map a circuit onto the backend
+# backend can also be a saved target, to transpile without connecting (see Cache.py)
+# cache=True reuses the transpiled circuit of an earlier run for the same circuit and target
+def isa_circuit(qc, backend, cache=True):
+   from qiskit.transpiler import Target
+   from qiskit.transpiler.preset_passmanagers import generate_preset_pass_manager
+
+   # This is a critical step and is needed to collect the
+   #     properties of the specific backend
+   target = backend if isinstance(backend, Target) else backend.target
+
+   if cache:
+      # Keep a copy of the target so this device can be transpiled for offline next time
+      if not isinstance(backend, Target):
+         Cache.store_target(backend.name, target)
 
-# Create transpilation pass manager with:
-# optimization_level=3: Aggressive optimizations
-# This is neccesarry for mapping qubits to the physical hardware
-pm = generate_preset_pass_manager(target=target, optimization_level=3)
+      key = Cache.circuit_key(qc, target)
+      qc_isa = Cache.load_circuit(key)
+      if qc_isa is not None:
+         return qc_isa
 
+   # Create transpilation pass manager with:
+   # optimization_level=3: Aggressive optimizations
+   # This is neccesarry for mapping qubits to the physical hardware
+   pm = generate_preset_pass_manager(target=target, optimization_level=3)
 
-# Transpile circuit to Instruction Set Architecture (ISA) format:
-# Converts gates to hardware-native basis gates
-# Maps virtual qubits to physical qubits
-# Adds swaps for connectivity constraints
-qc_isa = pm.run(qc) # Creates a hardware-compatable quantum circuit
 
+   # Transpile circuit to Instruction Set Architecture (ISA) format:
+   # Converts gates to hardware-native basis gates
+   # Maps virtual qubits to physical qubits
+   # Adds swaps for connectivity constraints
+   qc_isa = pm.run(qc) # Creates a hardware-compatable quantum circuit
 
-# print(qc_isa.draw()) 
-# Verify qubit mapping and gate decomposition
+   if cache:
+      Cache.store_circuit(key, qc_isa)
 
-# Adjust observables to match transpiled circuit's qubit mapping:
-# layout contains virtual→physical qubit mapping information
-# Required because transpilation may reorder qubits
-# Creates a hardware-compatable observable
-isa_observable = observable.apply_layout(layout=qc_isa.layout) 
+   return qc_isa
 
-# Initialize Estimator configured for selected backend 
-#  to handle job queuing and execution
-estimator = Estimator(mode=backend)
 
-# Create "publisher" (pub) object
-pub = (
-    qc_isa,  # remapped ISA circuit
-    [[isa_observable]], # remapped observables
-    individual_phases  # Parameter values to test
-)
+# Function to map the circuit and observable onto the backend
+def isa(qc, observable, backend):
 
-# Submit job to IBM Quantum system
-job = estimator.run(pubs=[pub])
-result = job.result()
+   qc_isa = isa_circuit(qc, backend)
 
-# This is our CHSH value, 
-#  if it is greater than 2, then the CHSH inequality has been violated
-S_values = result[0].data.evs[0] # Expectation values for the observable
+   # print(qc_isa.draw())
+   # Verify qubit mapping and gate decomposition
 
-print(S_values)
+   # Adjust observables to match transpiled circuit's qubit mapping:
+   # layout contains virtual→physical qubit mapping information
+   # Required because transpilation may reorder qubits
+   # Creates a hardware-compatable observable
+   isa_observable = observable.apply_layout(layout=qc_isa.layout)
 
-violation = np.any(np.abs(S_values) > 2)
-print(f"CHSH violation detected: {violation}")
+   return qc_isa, isa_observable
+
+
+#############################
+#         Batching          #
+#############################
+
+# Every job waits in the queue on its own, so it's much faster to send everything
+#   at once than to send one job per configuration.
+# A pub (primitive unified bloc) is one circuit with any number of observables and
+#   parameter values, and one job can hold many pubs. So the plan is:
+#     - every observable we want (S and its four terms) goes into the same pub
+#     - every set of phases goes into the same pub as parameter values
+#     - every circuit and repeated trial is its own pub, all in as few jobs as possible
+
+
+# Function to return the observables that can be measured
+# S and each of its four terms on their own
+def observables():
+   from qiskit.quantum_info import SparsePauliOp
+
+   terms = {label: SparsePauliOp(label) for label in ["ZZ", "ZX", "XZ", "XX"]}
+   terms["S"] = observable()
+   return terms
+
+
+# Function to build one pub per experiment
+# experiments is a list of (circuit, parameter values) pairs, i.e. [(circuit(), phases(20))]
+#   Repeating a pair in the list repeats it as a separate trial
+# measured is a dict of observables, i.e. observables()
+# Every circuit is only transpiled once, no matter how often it's repeated
+def pubs(experiments, measured, backend):
+
+   transpiled = {}
+   result = []
+   for qc, parameter_values in experiments:
+      if id(qc) not in transpiled:
+         transpiled[id(qc)] = isa_circuit(qc, backend)
+      qc_isa = transpiled[id(qc)]
+
+      # A column of observables against a list of parameter values gives
+      #   one expectation value for every observable at every parameter value
+      isa_observables = [[op.apply_layout(layout=qc_isa.layout)] for op in measured.values()]
+
+      result.append((qc_isa, isa_observables, parameter_values))
+
+   return result
+
+
+# Function to split the pubs into the groups sent as one job each
+# max_pubs is the most pubs to put in one job (default: all of them in one job)
+def groups(pub_list, max_pubs=None):
+   size = max_pubs or len(pub_list)
+   return [pub_list[i:i + size] for i in range(0, len(pub_list), size)]
+
+
+# Function to send pubs to the backend in as few jobs as possible
+# mode is how the jobs are sent:
+#   "batch"   - the jobs are run together as a Batch, the best choice for independent jobs
+#   "session" - the jobs get the backend to themselves, for jobs that depend on each other
+#   "job"     - every job is sent on its own
+# max_pubs is the most pubs to put in one job (default: all of them in one job)
+# Returns the list of jobs
+def submit(pub_list, backend, mode="batch", max_pubs=None):
+   from qiskit_ibm_runtime import Batch, Session, EstimatorV2 as Estimator
+
+   job_groups = groups(pub_list, max_pubs)
+
+   # One job doesn't need a batch or session around it
+   if mode == "job" or len(job_groups) == 1:
+      estimator = Estimator(mode=backend)
+      return [estimator.run(pubs=group) for group in job_groups]
+
+   execution = Batch if mode == "batch" else Session
+   with execution(backend=backend) as context:
+      estimator = Estimator(mode=context)
+      return [estimator.run(pubs=group) for group in job_groups]
+
+
+# Function to turn the result of one job into a dict of observable name -> expectation values per pub
+def values(result, names):
+   return [{name: pub_result.data.evs[i] for i, name in enumerate(names)} for pub_result in result]
+
+
+# Function to wait for the jobs and return the results of every pub, in order
+# Each result is a dict of observable name -> array of expectation values, one per parameter value
+def collect(jobs, names):
+   results = []
+   for job in jobs:
+      results += values(job.result(), names)
+   return results
+
+
+#############################
+#        Run the Job        #
+#############################
 
-print(f"Job ID: {job.job_id()}") # Unique identifier for job
-print(f"Job status: {job.status()}") # Should be 'DONE' if successful
+# Function to run the experiment on a backend and return the job
+def run(backend, number_of_phases=20):
+
+   # Initialize Estimator configured for selected backend
+   #  to handle job queuing and execution
+   # Create "publisher" (pub) object with the remapped ISA circuit,
+   #  the remapped S observable and the parameter values to test
+   pub_list = pubs([(circuit(), phases(number_of_phases))], {"S": observable()}, backend)
+
+   # Submit job to IBM Quantum system
+   return submit(pub_list, backend)[0]
+
+
+# The arguments are added by a function so chsh.py can reuse them for its hardware command
+def add_arguments(parser):
+   parser.add_argument(
+      "--token",
+      default=token,
+      help="IBM Quantum API token (default: the token variable at the top of CHSH_Experiment.py)"
+   )
+   parser.add_argument(
+      "--phases",
+      type=int,
+      default=20,
+      help="Number of phases between 0 and 2pi to measure (default: 20)"
+   )
+   parser.add_argument(
+      "--backend",
+      default=None,
+      help="Name of the device to run on, i.e. ibm_sherbrooke (default: the least busy one)"
+   )
+   parser.add_argument(
+      "--offline",
+      default=None,
+      metavar="BACKEND",
+      help="Only transpile for the saved snapshot of a device, without connecting (see Cache.py)"
+   )
+   parser.add_argument(
+      "--trials",
+      type=int,
+      default=1,
+      help="Number of times to repeat the experiment, all sent together (default: 1)"
+   )
+   parser.add_argument(
+      "--terms",
+      action="store_true",
+      help="Also measure the four terms ZZ, ZX, XZ, XX of S on their own"
+   )
+   parser.add_argument(
+      "--pairs",
+      type=int,
+      default=None,
+      help="Run the experiment on this many Bell pairs side by side, each with its own S"
+   )
+   parser.add_argument(
+      "--mode",
+      choices=["batch", "session", "job"],
+      default="batch",
+      help="How to send the jobs when there is more than one (default: batch)"
+   )
+   parser.add_argument(
+      "--max-pubs",
+      type=int,
+      default=None,
+      help="Most pubs to put into one job (default: everything in one job)"
+   )
+   parser.add_argument(
+      "--local",
+      default=None,
+      metavar="FAKE_BACKEND",
+      help="Run offline on a local fake backend, i.e. FakeSherbrooke, instead of IBM Quantum"
+   )
+   parser.add_argument(
+      "--jobs",
+      default=None,
+      metavar="FILE",
+      help="Keep the job IDs in FILE and print every result as soon as its job finishes"
+   )
+   parser.add_argument(
+      "--resume",
+      action="store_true",
+      help="Don't send new jobs, wait for the unfinished jobs in the --jobs file instead"
+   )
+   parser.add_argument(
+      "--latency",
+      type=float,
+      default=5.0,
+      help="Average seconds a --local job waits in its pretend queue when using --jobs (default: 5)"
+   )
+   return parser
+
+
+parser = add_arguments(argparse.ArgumentParser(
+   description="Run the CHSH experiment on IBM Quantum hardware"
+))
+
+
+# Function to print the expectation values of one trial
+def show(trial, result):
+   print(f"Trial {trial}:")
+   for name, evs in result.items():
+      print(f"{name}: {evs}")
+
+   # This is our CHSH value,
+   #  if it is greater than 2, then the CHSH inequality has been violated
+   if "S" in result:
+      violation = np.any(np.abs(result["S"]) > 2)
+      print(f"CHSH violation detected: {violation}")
+
+
+# Function to print the results of every tracked job as they finish
+async def follow(manager):
+   async for job_id, status, result in manager.results():
+      print(f"Job ID: {job_id}") # Unique identifier for job
+      print(f"Job status: {status}") # Should be 'DONE' if successful
+      if manager.error(job_id) is not None:
+         print(f"Job error: {manager.error(job_id)}")
+      if result is not None:
+         for trial, values_of_trial in enumerate(values(result, manager.names(job_id)), start=1):
+            show(trial, values_of_trial)
+
+
+# Function to transpile the circuit for a saved device snapshot, without connecting to IBM Quantum
+# The transpiled circuit is cached, so the next real run on that device can skip transpiling
+def offline(name):
+   target = Cache.load_target(name)
+   if target is None:
+      raise SystemExit(f"No saved target for {name}, saved targets: {', '.join(Cache.targets()) or 'none'}")
+
+   qc_isa = isa_circuit(circuit(), target)
+   print(f"Transpiled for {name}: depth {qc_isa.depth()}, {dict(qc_isa.count_ops())}")
+   return qc_isa
+
+
+# Run the experiment with already parsed arguments
+def command(args):
+
+   if args.offline is not None:
+      offline(args.offline)
+      return
+
+   if args.local is not None:
+      # A fake backend runs the jobs on this computer with a simulated copy of the device
+      import Noise
+      backend = Noise.fake_backend(args.local)
+      print(f"Using local backend: {backend.name}")
+   else:
+      service = connect(args.token)
+      backend = select_backend(service, args.backend)
+
+   if args.pairs:
+      measured = packed_observables(args.pairs)
+      qc = packed_circuit(args.pairs)
+   else:
+      measured = observables() if args.terms else {"S": observable()}
+      qc = circuit()
+
+   # The same circuit object is reused for every trial so it's only transpiled once
+   experiments = [(qc, phases(args.phases))] * args.trials
+
+   # Without a jobs file, wait for every job in turn and print everything at the end
+   if args.jobs is None:
+      jobs = submit(pubs(experiments, measured, backend), backend, args.mode, args.max_pubs)
+      results = collect(jobs, list(measured))
+
+      for trial, result in enumerate(results, start=1):
+         show(trial, result)
+
+      for job in jobs:
+         print(f"Job ID: {job.job_id()}") # Unique identifier for job
+         print(f"Job status: {job.status()}") # Should be 'DONE' if successful
+      return
+
+   # With a jobs file, poll every job at once and print each one as soon as it's done
+   import Jobs
+   if args.local is not None:
+      # The local jobs are saved next to the jobs file, so --resume can pick them back up
+      service = Jobs.LocalService(backend, latency=args.latency, directory=Path(args.jobs).with_suffix(".local"))
+   manager = Jobs.JobManager(service, args.jobs)
+
+   if not args.resume:
+      pub_list = pubs(experiments, measured, backend)
+      if args.local is not None:
+         jobs = [service.run(group) for group in groups(pub_list, args.max_pubs)]
+      else:
+         jobs = submit(pub_list, backend, args.mode, args.max_pubs)
+      manager.track(jobs, list(measured))
+
+   print(f"Waiting for {len(manager.pending())} jobs, their IDs are kept in {args.jobs}")
+   asyncio.run(follow(manager))
+
+
+def main(argv=None):
+   command(parser.parse_args(argv))
+
+
+# Only contact IBM Quantum when this program is run directly, not when it's imported
+if __name__=="__main__":
+   main()
@@ -0,0 +1,220 @@
+import hashlib
+import io
+import json
+import os
+import pickle
+from pathlib import Path
+
+# This program keeps the results of finished CHSH runs on disk so they never have to be run twice.
+#
+# Every result is stored under a key made from its configuration (shots, seed, angles, backend, ...).
+# Two runs with the same configuration get the same key, so the second one is read from disk.
+# Only seeded runs are cached, an unseeded run is meant to give a fresh random result every time.
+#
+# The cache is kept below max_size bytes by deleting the least recently used results first.
+#
+# It also keeps circuits transpiled for IBM Quantum hardware, and snapshots of the devices
+#   they were transpiled for, see the Transpiled Circuits section below.
+
+
+# The folder the results are kept in, created on first use
+# It can be moved with the CHSH_CACHE environment variable
+# It's made absolute here, so it stays the same folder if the program changes directory (see Benchmarks.py)
+cache_dir = Path(os.environ.get("CHSH_CACHE", ".chsh_cache")).resolve()
+
+# Upper limit on the total size of the cache in bytes (100 MB)
+max_size = 100 * 2**20
+
+
+# Function to turn a configuration into its key
+# sort_keys makes the key independent of the order the configuration was written in
+def key(config):
+    text = json.dumps(config, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def entry_path(config):
+    return cache_dir / f"{key(config)}.json"
+
+
+# Function to return the cached entry for a configuration, or None if it hasn't been run
+def load(config):
+    path = entry_path(config)
+
+    try:
+        with open(path) as file:
+            entry = json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+    # Touching the file marks it as recently used, see evict()
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        # Another process evicted it since it was read, which doesn't change what was read
+        pass
+    return entry
+
+
+# Function to save the counts and S of a finished run
+def store(config, counts, S):
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    path = entry_path(config)
+
+    entry = {"config": config, "counts": counts, "S": S}
+
+    # Write to a temporary file first and then rename it,
+    #   so a crash or a second process never leaves a half written entry behind
+    temporary = path.with_suffix(f".{os.getpid()}.tmp")
+    with open(temporary, "w") as file:
+        json.dump(entry, file, default=str)
+    os.replace(temporary, path)
+
+    evict()
+
+
+# Every file that can be evicted, results and transpiled circuits
+def files():
+    return list(cache_dir.glob("*.json")) + list(isa_dir.glob("*.qpy"))
+
+
+# Function to delete the least recently used entries until the cache fits in max_size
+def evict():
+    entries = []
+    for path in files():
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            # Another process evicted it first
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+
+    # Oldest first
+    for _, size, path in sorted(entries):
+        if total <= max_size:
+            break
+        path.unlink(missing_ok=True)
+        total -= size
+
+
+# Function to delete every entry, including the transpiled circuits and device snapshots
+def clear():
+    for path in files() + list(target_dir.glob("*.pkl")):
+        path.unlink(missing_ok=True)
+
+
+#############################
+#    Transpiled Circuits    #
+#############################
+
+# Transpiling for real hardware at optimization level 3 takes a while, and gives a circuit
+#   that works just as well every time for the same circuit and device, so it's kept too.
+# Circuits are saved with QPY, Qiskit's own file format, which keeps the layout of the circuit,
+#   so observables can still be mapped onto it with apply_layout after it's loaded.
+#
+# The device's target (its qubits, gates and error rates) is saved as well,
+#   so circuits can be transpiled for it later without connecting to IBM Quantum.
+# When the device is recalibrated its target changes, and so does the key of every circuit.
+
+isa_dir = cache_dir / "isa"
+target_dir = cache_dir / "targets"
+
+
+# Function to write bytes to a file without ever leaving a half written file behind
+def write_atomic(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_suffix(f".{os.getpid()}.tmp")
+    with open(temporary, "wb") as file:
+        file.write(data)
+    os.replace(temporary, path)
+
+
+# Function to describe everything about a target the transpiler uses, in a fixed order
+# A pickled target can't be used for this, it holds sets whose order changes in every process
+def target_description(target):
+    operations = {}
+    for name in sorted(target.operation_names):
+        properties = []
+        for qargs, instruction in target[name].items():
+            properties.append([None if qargs is None else list(qargs),
+                               getattr(instruction, 'error', None),
+                               getattr(instruction, 'duration', None)])
+        operations[name] = sorted(properties, key=str)
+
+    qubits = [None if qubit is None else [qubit.t1, qubit.t2, qubit.frequency]
+              for qubit in (target.qubit_properties or [])]
+
+    return {"num_qubits": target.num_qubits, "dt": target.dt, "operations": operations, "qubits": qubits}
+
+
+def target_key(target):
+    return key(target_description(target))
+
+
+# Function to make the key of a circuit transpiled for a target
+# The circuit is written as OpenQASM 3 for the key because QPY also saves the random IDs
+#   of the circuit's parameters, which would give the same circuit a new key every run
+def circuit_key(qc, target, optimization_level=3):
+    import qiskit
+    from qiskit import qasm3
+
+    return key({"circuit": qasm3.dumps(qc),
+                "target": target_key(target),
+                "optimization_level": optimization_level,
+                "qiskit": qiskit.__version__})
+
+
+# Function to return the cached transpiled circuit for a key, or None if there isn't one
+def load_circuit(circuit_key):
+    from qiskit import qpy
+
+    path = isa_dir / f"{circuit_key}.qpy"
+    try:
+        with open(path, "rb") as file:
+            qc = qpy.load(file)[0]
+    except FileNotFoundError:
+        return None
+
+    # Touching the file marks it as recently used, see evict()
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        # Another process evicted it since it was read, which doesn't change what was read
+        pass
+    return qc
+
+
+def store_circuit(circuit_key, qc):
+    from qiskit import qpy
+
+    buffer = io.BytesIO()
+    qpy.dump(qc, buffer)
+    write_atomic(isa_dir / f"{circuit_key}.qpy", buffer.getvalue())
+
+    evict()
+
+
+# Function to save a snapshot of a device's target, named after the device (i.e. ibm_sherbrooke)
+# Nothing is written if the snapshot is already up to date
+def store_target(name, target):
+    saved = load_target(name)
+    if saved is not None and target_key(saved) == target_key(target):
+        return
+
+    write_atomic(target_dir / f"{name}.pkl", pickle.dumps(target))
+
+
+# Function to return the saved target of a device, or None if it's never been used
+def load_target(name):
+    try:
+        with open(target_dir / f"{name}.pkl", "rb") as file:
+            return pickle.load(file)
+    except FileNotFoundError:
+        return None
+
+
+# Names of the devices with a saved target
+def targets():
+    return sorted(path.stem for path in target_dir.glob("*.pkl"))
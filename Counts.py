@@ -0,0 +1,93 @@
+import numpy as np
+
+# Qiskit returns counts as dictionaries like {'00': 500, '11': 480, '01': 12, '10': 8}.
+# That is easy to read, but every calculation on them needs a Python loop over the keys.
+#
+# This program stores counts as integer arrays instead. The last axis always has 4 entries,
+#   the number of 00, 01, 10 and 11 outcomes, so outcome i is just the bitstring of i.
+#   (The same order as the Qiskit statevector and Exact.probabilities)
+#
+# One run of the four settings is a (4, 4) array, ordered like measurement_settings in Aer_Qasm.py,
+#   and a whole sweep of n runs is an (n, 4, 4) array. Every function below works on any
+#   number of leading axes, so thousands of experiments are handled in a single call.
+
+
+# The bitstring of each outcome
+outcomes = ['00', '01', '10', '11']
+
+# +1 when Alice and Bob agree (00, 11), -1 when they disagree (01, 10)
+parity = np.array([1, -1, -1, 1])
+
+# The sign of each setting in S = E(A0B0) − E(A0B1) + E(A1B0) + E(A1B1)
+signs = np.array([1, -1, 1, 1])
+
+
+# Function to convert Qiskit counts into an array
+# Takes a single dict, a list of dicts, or nested lists of dicts
+def to_array(counts):
+
+    if isinstance(counts, dict):
+        array = np.zeros(4, dtype=np.int64)
+        for bitstring, count in counts.items():
+            # Remove any spaces Qiskit puts between classical registers
+            array[int(bitstring.replace(' ', ''), 2)] += count
+        return array
+
+    return np.array([to_array(item) for item in counts], dtype=np.int64)
+
+
+# Function to split the counts of a circuit with several Bell pairs into counts for each pair
+# Pair k is measured into classical bits 2k (Alice) and 2k+1 (Bob)
+# Returns a (pairs, 4) array, the same outcome order as to_array
+def marginals(counts, pairs):
+    keys = [bitstring.replace(' ', '') for bitstring in counts]
+    weights = np.fromiter(counts.values(), dtype=np.int64, count=len(keys))
+
+    # Every bitstring as a row of 0s and 1s, reversed so column i is classical bit i
+    bits = np.frombuffer(''.join(keys).encode(), dtype=np.uint8).reshape(len(keys), -1)[:, ::-1] - ord('0')
+
+    # The outcome of every pair in every bitstring, Bob is the high bit as usual
+    outcome = bits[:, 0:2 * pairs:2] + 2 * bits[:, 1:2 * pairs:2]
+
+    # Count each (pair, outcome) with one bincount, every bitstring weighted by how often it happened
+    index = outcome + 4 * np.arange(pairs)
+    totals = np.bincount(index.ravel(), weights=np.repeat(weights, pairs), minlength=4 * pairs)
+    return totals.reshape(pairs, 4).astype(np.int64)
+
+
+# Function to convert an array back into Qiskit style counts
+# Outcomes that never happened are left out, the same as in Aer's counts
+def to_dicts(array):
+    array = np.asarray(array)
+
+    if array.ndim == 1:
+        return {outcomes[i]: int(n) for i, n in enumerate(array) if n > 0}
+
+    return [to_dicts(item) for item in array]
+
+
+# Function to add up counts from several runs of the same experiment
+# i.e. merge(first_chunk, second_chunk, ...) all with the same shape
+def merge(*arrays):
+    return np.sum(arrays, axis=0)
+
+
+# Function to calculate E for every experiment at once
+# E = (N_00 + N_11 - N_01 - N_10) / N_total, the last axis is removed
+def expectation(array):
+    array = np.asarray(array)
+    return (array @ parity) / array.sum(axis=-1)
+
+
+# Function to calculate S for every run at once
+# The last two axes are (4 settings, 4 outcomes) and are both removed
+def S(array):
+    return expectation(array) @ signs
+
+
+# Function to calculate the standard error of S from the counts of a run
+# Each shot is ±1 so E has variance (1 - E^2)/N, and the four independent settings add up
+def standard_error(array):
+    array = np.asarray(array)
+    variance = (1 - expectation(array)**2) / array.sum(axis=-1)
+    return np.sqrt(variance.sum(axis=-1))
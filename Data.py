@@ -1,70 +1,401 @@
-from Aer_Qasm import CHSH
+import Aer_Qasm
+import Cache
+import Counts
+import Noise
+import Timing
 import GSPlotter as gsp
+from Store import Store
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import numpy as np
+import argparse
+import json
+import os
 import time
 
-start = time.time()
 
-def DataCollection():
+# Function to run a single point of the sweep
+# This runs inside a worker process, so it has to be a plain top level function
+# Returns the counts of each setting, S, how many seconds the run took,
+#   and its timing report (see Timing.py) if timing is True, otherwise None
+# cache=False keeps the run out of the cache, for sweeps whose seeds can't be made again
+def task(shots, seed, threads, sampler, noise, timing=False, profile=False, cache=True):
+	start = time.perf_counter()
 
-	values = []
-	shot_list = []
-	iterator = 0
-	for exponent in range(20,30):
-		shots = 2**exponent
-		for i in range(0,6):
-			iterator += 1
-			S = CHSH(shots)
-			values.append(S)
-			shot_list.append(shots)
-			print(f"{iterator}: {S = }; {shots = }")
-			print(f"S - 2√2: {S - 2.8284271247}")
+	report = Timing.Report(profile, profile) if timing else None
+	if report is not None:
+		report.start()
 
-	return values, shot_list
+	# max_parallel_threads keeps every worker's Aer simulator on its share of the cores
+	counts_list = Aer_Qasm.run(shots, sampler=sampler, seed=seed, noise=noise, report=report,
+							   cache=cache, max_parallel_threads=threads)
+	S = Aer_Qasm.S_value(counts_list, report)
 
+	if report is not None:
+		report.stop()
+		report = report.to_dict()
 
-print("Starting calcuations...")
+	seconds = time.perf_counter() - start
+	return Counts.to_array(counts_list), S, seconds, report
 
-CHSH_Values, shots = DataCollection()
 
-print("Manipulating data")
+# Function to return every run in the sweep
+# Every (exponent, repetition) pair is one run, in the order they are plotted
+# Returns the (exponent, repetition) pairs, the shots and the seed of each run
+def grid(exponents=range(20,30), repetitions=6, seed=None):
 
-print(f"{CHSH_Values = }")
-print(f"{shots = }")
+	points = [(exponent, i) for exponent in exponents for i in range(repetitions)]
+	shot_list = [2**exponent for exponent, i in points]
 
+	# SeedSequence.spawn gives statistically independent seeds for each run
+	seeds = [int(child.generate_state(1)[0]) for child in np.random.SeedSequence(seed).spawn(len(points))]
 
-NEW_CHSH_Values = [CHSH_Values, [2.8284271247]*60 ]
-NEW_shots = [shots, shots]
-print(f"{NEW_CHSH_Values = }")
-print(f"{NEW_shots = }")
+	return points, shot_list, seeds
 
-print(type(NEW_CHSH_Values[0]))
 
-print(len(NEW_CHSH_Values[0]))
-print(len(NEW_CHSH_Values[1]))
+# Function to look up every run of the sweep in the cache (see Cache.py)
+# Returns the cache entry of each run, or None for runs that haven't been done yet
+def cached(shot_list, seeds, sampler=False, noise=None):
 
-print(type(NEW_shots[0]))
+	entries = []
+	for shots, run_seed in zip(shot_list, seeds):
+		entries.append(Cache.load(Aer_Qasm.config(shots, sampler, run_seed, noise)))
 
-print(len(NEW_shots[0]))
-print(len(NEW_shots[1]))
+	return entries
 
 
-print("Plotting...")
+# The columns every run is saved with in a sweep store (see Store.py)
+columns = {
+	'exponent': ('int64', ()),
+	'repetition': ('int64', ()),
+	'shots': ('int64', ()),
+	'seed': ('int64', ()),
+	'counts': ('int64', (4, 4)),	# (4 settings, 4 outcomes), see Counts.py
+	'S': ('float64', ()),
+	'seconds': ('float64', ()),
+}
 
-gsp.plotter(
-    x_values=NEW_shots,             
-    y_values=NEW_CHSH_Values,             
-    xlabel='Shot Count', 
-    ylabel='S Values',                   
-    plot_labels=["Calculated S Values", "2√2"],                   
-    title='Qasm Simulator Noise',                    
-    filename='figure.png',                  
-    colors=['red', 'black'],          
-    line_styles=["--", "-"],          
-)
 
-end = time.time()
-runtime = end - start
-runtime_minutes = runtime/60
+# Function to open the sweep store at path, making it if it doesn't exist yet
+def open_store(path):
+	return Store(path, columns)
 
-print(f"Program took {runtime_minutes} minutes")
\ No newline at end of file
+
+# workers is the number of processes to spread the runs over (default: every core)
+# seed seeds the whole sweep, every run gets its own independent seed derived from it
+# noise is an optional noise model, see Noise.py
+# live is an optional gsp.LivePlotter that gets every result as soon as it's done
+# store is an optional Store that every run is saved to as soon as it's done
+#   Runs that are already in it are skipped, so a crashed sweep picks up where it stopped
+#   The runs in it are matched by (exponent, repetition), and a store made with another sampler or
+#   noise model, or (with a seed) runs with other seeds than this sweep's, is refused with a ValueError
+# timing is an optional list that the timing report of every run that is computed gets added to
+#   profile=True adds cProfile and tracemalloc results to those reports
+# Returns the S of every run, the shots of every run, and the standard error of every S,
+#   which comes from the run's own counts (see Statistics.py), so one repetition is enough to see the spread
+def DataCollection(exponents=range(20,30), repetitions=6, workers=None, seed=None, sampler=False, noise=None,
+				   live=None, store=None, timing=None, profile=False):
+
+	points, shot_list, seeds = grid(exponents, repetitions, seed)
+
+	# Split the cores between the workers so the Aer threads don't fight over them
+	cores = os.cpu_count() or 1
+	workers = workers or cores
+	threads = max(1, cores // workers)
+
+	values = [None] * len(points)
+	counts_list = [None] * len(points)
+
+	# Runs that are already in the store are done
+	if store is not None:
+		store.check_settings({'sampler': sampler, 'noise': noise})
+
+		done = {}
+		for row, (exponent, repetition) in enumerate(zip(store.column('exponent'), store.column('repetition'))):
+			done[(int(exponent), int(repetition))] = row
+		stored_S, stored_counts, stored_seeds = store.column('S'), store.column('counts'), store.column('seed')
+		for i, point in enumerate(points):
+			if point in done:
+				# Without a seed every run gets a random one, so only seeded sweeps can be checked
+				if seed is not None and int(stored_seeds[done[point]]) != seeds[i]:
+					raise ValueError(f"Run {point} in {store.path} has seed {int(stored_seeds[done[point]])}, "
+									 f"not {seeds[i]}; was the store made with another --seed?")
+				values[i] = float(stored_S[done[point]])
+				counts_list[i] = np.array(stored_counts[done[point]])
+		print(f"{len(values) - values.count(None)} of {len(values)} runs found in {store.path}")
+
+	# Without a seed for the whole sweep every run gets a new random seed, that no later sweep
+	#   can ask for again, so those runs are neither looked up in nor added to the cache
+	cache = seed is not None
+
+	# Points that were already run with the same seed come straight from the cache
+	for i, entry in enumerate(cached(shot_list, seeds, sampler, noise) if cache else []):
+		if values[i] is None and entry is not None:
+			values[i] = entry['S']
+			counts_list[i] = Counts.to_array(entry['counts'])
+			if store is not None:
+				save(store, points[i], shot_list[i], seeds[i], counts_list[i], entry['S'], 0.0)
+
+	missing = [i for i, S in enumerate(values) if S is None]
+	print(f"{len(values) - len(missing)} of {len(values)} runs already done")
+
+	if live is not None:
+		for shots, S in zip(shot_list, values):
+			if S is not None:
+				live_update(live, shots, S)
+
+	# Every result is put back at its own index, so values stays in the same order as the grid
+	#   no matter which run finishes first
+	with ProcessPoolExecutor(max_workers=workers) as executor:
+		futures = {}
+		for i in missing:
+			future = executor.submit(task, shot_list[i], seeds[i], threads, sampler, noise,
+									 timing is not None, profile, cache)
+			futures[future] = i
+
+		for future in as_completed(futures):
+			i = futures[future]
+			counts, S, seconds, report = future.result()
+			values[i] = S
+			counts_list[i] = counts
+			if timing is not None:
+				timing.append(report)
+			if store is not None:
+				save(store, points[i], shot_list[i], seeds[i], counts, S, seconds)
+			if live is not None:
+				live_update(live, shot_list[i], S)
+
+	if live is not None:
+		live.close()
+
+	# The standard error of every run at once, from its (4 settings, 4 outcomes) counts
+	errors = Counts.standard_error(np.array(counts_list)).tolist()
+
+	for iterator, (S, error, shots) in enumerate(zip(values, errors, shot_list), start=1):
+		print(f"{iterator}: S = {S} ± {error:.2e}; {shots = }")
+		print(f"S - 2√2: {S - 2.8284271247}")
+
+	return values, shot_list, errors
+
+
+# Function to save one finished run to a sweep store
+def save(store, point, shots, seed, counts, S, seconds):
+	exponent, repetition = point
+	store.append(exponent=exponent, repetition=repetition, shots=shots, seed=seed,
+				 counts=counts, S=S, seconds=seconds)
+
+
+# Function to add one finished run to a live plot
+def live_update(live, shots, S):
+	live.append("Calculated S Values", shots, S)
+	live.append("2√2", shots, 2.8284271247)
+
+
+# Function to make a live plot for the sweep, see gsp.LivePlotter
+def live_plot(filename='figure.png', interval=30):
+	return gsp.LivePlotter(
+	    plot_labels=["Calculated S Values", "2√2"],
+	    title='Qasm Simulator Noise',
+	    xlabel='Shot Count',
+	    ylabel='S Values',
+	    filename=f"live_{filename}",
+	    colors=['red', 'black'],
+	    line_styles=["--", "-"],
+	    interval=interval,
+	)
+
+
+# Function to plot the S values of the sweep against 2√2
+# errors are optional error bars for the S values, i.e. their standard errors
+def plot(CHSH_Values, shots, filename='figure.png', errors=None):
+
+	NEW_CHSH_Values = [CHSH_Values, [2.8284271247]*len(CHSH_Values) ]
+	NEW_shots = [shots, shots]
+
+	gsp.plotter(
+	    x_values=NEW_shots,             
+	    y_values=NEW_CHSH_Values,             
+	    xlabel='Shot Count', 
+	    ylabel='S Values',                   
+	    plot_labels=["Calculated S Values", "2√2"],                   
+	    title='Qasm Simulator Noise',                    
+	    filename=filename,                  
+	    colors=['red', 'black'],          
+	    line_styles=["--", "-"],          
+	    errors=None if errors is None else [errors, None],
+	)
+
+
+# The arguments that describe a sweep, so the plot command can find the same runs again
+def add_sweep_arguments(parser):
+	parser.add_argument(
+		"--seed",
+		type=int,
+		default=None,
+		help="Seed for the whole sweep, for repeatable results"
+	)
+	parser.add_argument(
+		"--repetitions", "-r",
+		type=int,
+		default=1,
+		help="Number of runs per shot count (default: 1, every run has its own error bar)"
+	)
+	parser.add_argument(
+		"--sampler",
+		action="store_true",
+		help="Draw the counts from the exact probabilities instead of running the simulator"
+	)
+	parser.add_argument(
+		"--noise", "-n",
+		type=Noise.parse,
+		default=None,
+		help="Noise model, i.e. depolarizing=0.01,readout=0.02 or backend=FakeSherbrooke (default: none)"
+	)
+	parser.add_argument(
+		"--filename", "-f",
+		default="figure.png",
+		help="Name of the plot saved in plots/ (default: figure.png)"
+	)
+	return parser
+
+
+# The arguments are added by a function so chsh.py can reuse them for its sweep command
+def add_arguments(parser):
+	parser.add_argument(
+		"--workers", "-w",
+		type=int,
+		default=None,
+		help="Number of worker processes (default: one per core)"
+	)
+	add_sweep_arguments(parser)
+	parser.add_argument(
+		"--store",
+		default=None,
+		metavar="PATH",
+		help="Save every run to the sweep store at PATH as it finishes, and skip runs already in it"
+	)
+	parser.add_argument(
+		"--timing",
+		default=None,
+		metavar="PATH",
+		help="Time every phase of every run and save the reports, and their totals, as JSON to PATH"
+	)
+	parser.add_argument(
+		"--profile",
+		action="store_true",
+		help="Add cProfile and tracemalloc results to the --timing reports"
+	)
+	parser.add_argument(
+		"--live",
+		type=float,
+		default=None,
+		metavar="SECONDS",
+		help="Update plots/live_<filename> with the results so far every SECONDS while the sweep runs"
+	)
+	return parser
+
+
+parser = add_arguments(argparse.ArgumentParser(
+	description="Run the CHSH shot-count sweep and plot the results"
+))
+
+
+# Run the sweep and plot it, with already parsed arguments
+def command(args):
+
+	start = time.time()
+
+	print("Starting calcuations...")
+
+	live = None if args.live is None else live_plot(args.filename, args.live)
+	store = None if args.store is None else open_store(args.store)
+	reports = None if args.timing is None else []
+
+	CHSH_Values, shots, errors = DataCollection(repetitions=args.repetitions, workers=args.workers, seed=args.seed,
+											sampler=args.sampler, noise=args.noise, live=live, store=store,
+											timing=reports, profile=args.profile)
+
+	if reports is not None:
+		summary = Timing.aggregate(reports)
+		with open(args.timing, "w") as file:
+			json.dump({"summary": summary, "runs": reports}, file, indent=2)
+
+		print(f"Time spent in each phase over {summary['runs']} runs:")
+		for name, total in summary["totals"].items():
+			print(f"{name:12} wall {total['wall']:10.3f} s   cpu {total['cpu']:10.3f} s")
+
+	print("Manipulating data")
+
+	print(f"{CHSH_Values = }")
+	print(f"{shots = }")
+
+	print("Plotting...")
+
+	plot(CHSH_Values, shots, args.filename, errors)
+
+	end = time.time()
+	runtime = end - start
+	runtime_minutes = runtime/60
+
+	print(f"Program took {runtime_minutes} minutes")
+
+
+# The arguments of chsh.py's plot command, which only needs to describe the sweep, not run it
+def add_plot_arguments(parser):
+	add_sweep_arguments(parser)
+	parser.add_argument(
+		"--store",
+		default=None,
+		metavar="PATH",
+		help="Plot the runs in the sweep store at PATH instead of the ones in the cache"
+	)
+	return parser
+
+
+# Re-plot a sweep without running anything
+# With --store the runs are read straight from the sweep store, and repetitions are shown as mean ± error
+# Otherwise only the runs already in the cache are plotted, and the sweep has to be described
+#   the same way as when it was run (same --seed, --sampler, --noise)
+def plot_command(args):
+
+	if args.store is not None:
+		store = Store(args.store)
+		print(f"Plotting {len(store)} runs from {store.path}")
+
+		# With one run per shot count, every run gets its own standard error as its error bar
+		# Otherwise the repetitions are averaged and their spread is the error bar
+		errors = None
+		if len(np.unique(store.column('shots'))) == len(store):
+			errors = [Counts.standard_error(store.column('counts')), None]
+
+		gsp.store_plotter(
+		    store,
+		    x_column='shots',
+		    y_columns=['S', 2.8284271247],
+		    xlabel='Shot Count',
+		    ylabel='S Values',
+		    plot_labels=["Calculated S Values", "2√2"],
+		    title='Qasm Simulator Noise',
+		    filename=args.filename,
+		    colors=['red', 'black'],
+		    line_styles=["--", "-"],
+		    errors=errors,
+		)
+		return
+
+	points, shot_list, seeds = grid(repetitions=args.repetitions, seed=args.seed)
+	entries = cached(shot_list, seeds, args.sampler, args.noise)
+
+	done = [i for i, entry in enumerate(entries) if entry is not None]
+	print(f"Plotting {len(done)} of {len(entries)} runs found in the cache")
+
+	errors = Counts.standard_error(Counts.to_array([entries[i]['counts'] for i in done])).tolist() if done else None
+	plot([entries[i]['S'] for i in done], [shot_list[i] for i in done], args.filename, errors)
+
+
+def main(argv=None):
+	command(parser.parse_args(argv))
+
+
+# The worker processes import this file, so the sweep must only start when it is run directly
+if __name__=="__main__":
+	main()
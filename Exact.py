@@ -0,0 +1,270 @@
+import numpy as np
+
+# This program computes the noiseless CHSH experiment without running a simulator at all.
+# For 2 qubits the whole state is only 4 numbers, so the Bell state and the measurement
+# rotations can be written out as small matrices and applied with NumPy directly.
+# Because NumPy works on whole arrays at once, the same code evaluates one set of angles
+# or millions of them in a single call.
+
+# The results match Aer_StateVector.py, see crosscheck() there.
+
+
+##################
+#   Bell State   #
+##################
+
+# |Phi^+> = 1/√2 * (|00> + |11>)
+# Written as a 2x2 array psi[q1, q0], so psi[0, 0] is |00> and psi[1, 1] is |11>
+# Indexing it as [q1, q0] matches Qiskit's bitstring ordering '...,q1,q0'
+bell_state = np.array([[1, 0],
+                       [0, 1]]) / np.sqrt(2)
+
+# The same angles that are used in Aer_Qasm.py and Aer_StateVector.py
+angles = {
+    'A0': np.pi / 2,   # Measure in the X-basis
+    'A1': 0,           # Measure in the Z-basis
+    'B0': np.pi / 4,   # Measure at pi/4 from the Z-axis
+    'B1': -np.pi / 4   # Measure at -pi/4 from the Z-axis
+}
+
+# The sign of each setting in S = E(A0B0) − E(A0B1) + E(A1B0) + E(A1B1)
+# Ordered (A0,B0), (A0,B1), (A1,B0), (A1,B1)
+signs = np.array([1, -1, 1, 1])
+
+
+################
+#   Rotation   #
+################
+
+# Function to return RY(theta) for an array of angles
+# The output has shape theta.shape + (2, 2), one 2x2 matrix per angle
+def ry(theta):
+    theta = np.asarray(theta, dtype=float)
+
+    cos = np.cos(theta / 2)
+    sin = np.sin(theta / 2)
+
+    # RY(theta) = [ Cos(θ/2)  -Sin(θ/2) ]
+    #             [ Sin(θ/2)   Cos(θ/2) ]
+    return np.stack([np.stack([cos, -sin], axis=-1),
+                     np.stack([sin,  cos], axis=-1)], axis=-2)
+
+
+###################
+#   Probability   #
+###################
+
+# Function to return the outcome probabilities after measuring Alice at angle alice and Bob at angle bob
+# alice and bob are broadcast against each other
+# The output has a trailing axis of 4 ordered |00>, |01>, |10>, |11> like the Qiskit statevector
+def probabilities(alice, bob):
+    alice, bob = np.broadcast_arrays(np.asarray(alice, dtype=float),
+                                     np.asarray(bob, dtype=float))
+
+    # Same convention as measure() in Aer_Qasm.py, the rotation is by -angle
+    rotation_A = ry(-alice)   # acts on q0
+    rotation_B = ry(-bob)     # acts on q1
+
+    # amplitude[q1, q0] = sum over k, l of RY_B[q1, k] * RY_A[q0, l] * psi[k, l]
+    # This is (RY_B ⊗ RY_A) |Phi^+> for every pair of angles at once
+    amplitudes = np.einsum('...ik,...jl,kl->...ij', rotation_B, rotation_A, bell_state)
+
+    # Square the probability amplitudes and flatten [q1, q0] into the 4 outcomes
+    probs = np.abs(amplitudes)**2
+    return probs.reshape(alice.shape + (4,))
+
+
+###################
+#   Expectation   #
+###################
+
+# Function to calculate E from outcome probabilities
+# (P_00 + P_11) - (P_01 + P_10), agreement minus disagreement
+def expectation(probs):
+    probs = np.asarray(probs)
+    return (probs[..., 0] + probs[..., 3]) - (probs[..., 1] + probs[..., 2])
+
+
+# Function to calculate E(a, b) for arrays of Alice's and Bob's angles
+def correlators(alice, bob):
+    return expectation(probabilities(alice, bob))
+
+
+#######################
+#   CHSH Experiment   #
+#######################
+
+# Function to calculate the four correlators and S for arrays of all four angles
+# Returns E with a trailing axis of 4 (ordered like signs) and S
+def angle_sweep(A0, A1, B0, B1):
+
+    A0, A1, B0, B1 = np.broadcast_arrays(*[np.asarray(x, dtype=float) for x in (A0, A1, B0, B1)])
+
+    # Pair up the angles as (A0,B0), (A0,B1), (A1,B0), (A1,B1)
+    alice = np.stack([A0, A0, A1, A1], axis=-1)
+    bob = np.stack([B0, B1, B0, B1], axis=-1)
+
+    E = correlators(alice, bob)
+    S = E @ signs
+
+    return E, S
+
+
+# Function to calculate S, by default at the angles that maximize the violation
+def CHSH(A0=angles['A0'], A1=angles['A1'], B0=angles['B0'], B1=angles['B1']):
+    E, S = angle_sweep(A0, A1, B0, B1)
+    return S
+
+
+####################
+#   Optimization   #
+####################
+
+# The angles above are only the best ones for a perfect Bell state. With noise, or a different state,
+#   other angles can give a larger S. Instead of simulating a grid of angles, S is written out
+#   in closed form and maximized with its exact gradient.
+#
+# Measuring at angle a measures the observable cos(a) Z + sin(a) X, so with u(a) = (1, cos a, sin a)
+#
+#   E(a, b) = u(a) @ K @ v(b)
+#
+# where K is a 3x3 matrix that holds everything about the state and the noise:
+#   K[0, 0] is a constant, K[1:, 0] and K[0, 1:] are Alice's and Bob's own Z and X averages,
+#   and K[1:, 1:] are the ZZ, ZX, XZ, XX correlations (rows are Alice, columns are Bob).
+# Readout error that isn't the same for 0 and 1 shows up in the constant and the averages.
+#
+# K can be found two ways:
+#   - from E measured (or simulated) at a 3x3 grid of angles, see correlation_matrix()
+#   - in closed form for the state cos θ|00> + sin θ|11> with the noise models of Noise.py,
+#     see state_correlations(), which also gives its derivative so θ can be optimized too
+
+# The angles K is measured at, for both Alice and Bob
+# Any 3 angles that aren't a half turn apart work, but the transpiler removes rotations by 0 or π,
+#   and their gate noise with them, so these are all rotations that are kept
+tomography_angles = np.array([np.pi / 4, 3 * np.pi / 4, -np.pi / 4])
+
+
+# Function to return u(a) = (1, cos a, sin a) and its derivative for an array of angles
+def basis(a):
+    a = np.asarray(a, dtype=float)
+    u = np.stack([np.ones_like(a), np.cos(a), np.sin(a)], axis=-1)
+    du = np.stack([np.zeros_like(a), -np.sin(a), np.cos(a)], axis=-1)
+    return u, du
+
+
+# Function to return K from the 3x3 grid of E at tomography_angles, E[Alice's angle, Bob's angle]
+def correlation_matrix(E):
+    U = np.linalg.inv(basis(tomography_angles)[0])
+    return U @ np.asarray(E) @ U.T
+
+
+# Function to return K and dK/dθ for the state cos θ|00> + sin θ|11> (θ = π/4 is the Bell state)
+# depolarizing and readout are the same noise as in Noise.py: every gate is followed by a depolarizing
+#   error and every measured bit is flipped with probability readout
+# theta can be an array, the output then has shape theta.shape + (3, 3)
+def state_correlations(theta=np.pi / 4, depolarizing=0, readout=0):
+    theta = np.asarray(theta, dtype=float)[..., None, None]
+    p = depolarizing
+
+    # The noiseless state, split into the parts that don't depend on θ, depend on cos 2θ and on sin 2θ
+    # Rows are Alice's I, Z, X and columns are Bob's
+    constant = np.array([[1, 0, 0], [0, 1, 0], [0, 0, 0]])
+    cos_part = np.array([[0, 1, 0], [1, 0, 0], [0, 0, 0]])
+    sin_part = np.array([[0, 0, 0], [0, 0, 0], [0, 0, 1]])
+
+    K = constant + np.cos(2 * theta) * cos_part + np.sin(2 * theta) * sin_part
+    dK = -2 * np.sin(2 * theta) * cos_part + 2 * np.cos(2 * theta) * sin_part
+
+    # The error on Alice's first rotation turns part of the state into an even mix of |00> and |11>
+    mixture = np.array([[1, 0, 0], [0, 1, 0], [0, 0, 0]])
+    K = (1 - p) * K + p * mixture
+    dK = (1 - p) * dK
+
+    # The error on the CNOT shrinks every correlation and average,
+    #   and the errors on the measurement rotations shrink each qubit's own parts again
+    cnot = np.full((3, 3), 1 - p)
+    cnot[0, 0] = 1
+    rotation = np.diag([1, 1 - p, 1 - p])
+
+    # Readout error scales every measured ±1 by 1 - 2 * readout
+    measurement = np.diag([0, 1 - 2 * readout, 1 - 2 * readout]) @ rotation
+
+    K = measurement @ (cnot * K) @ measurement.T
+    dK = measurement @ (cnot * dK) @ measurement.T
+
+    return K, dK
+
+
+# Function to return S and its gradient with respect to the four angles, x = (A0, A1, B0, B1)
+# x has shape (..., 4) and K shape (..., 3, 3), so every restart can have its own K
+def S_gradient(x, K):
+    (uA0, duA0), (uA1, duA1), (vB0, dvB0), (vB1, dvB1) = [basis(x[..., i]) for i in range(4)]
+
+    # Bob's side of every term of S = E(A0B0) − E(A0B1) + E(A1B0) + E(A1B1)
+    difference = np.einsum('...ij,...j->...i', K, vB0 - vB1)
+    total = np.einsum('...ij,...j->...i', K, vB0 + vB1)
+
+    S = np.einsum('...i,...i->...', uA0, difference) + np.einsum('...i,...i->...', uA1, total)
+
+    gradient = np.stack([
+        np.einsum('...i,...i->...', duA0, difference),
+        np.einsum('...i,...i->...', duA1, total),
+        np.einsum('...i,...ij,...j->...', uA0 + uA1, K, dvB0),
+        np.einsum('...i,...ij,...j->...', uA1 - uA0, K, dvB1),
+    ], axis=-1)
+
+    return S, gradient
+
+
+# Function to find the angles (and optionally the state) that give the largest S
+# K is the correlation matrix to optimize for, by default the one of state_correlations()
+#   with the given depolarizing and readout noise
+# prepare=True also optimizes θ of the state cos θ|00> + sin θ|11>, which needs K from state_correlations()
+# Every one of restarts random starting points is climbed at the same time, and the best one is kept
+# start is an optional dictionary of angles (A0, A1, B0, B1) that is used as one of the starting points
+# Returns a dictionary with the angles, θ (with prepare=True) and the largest S
+def optimize(K=None, depolarizing=0, readout=0, prepare=False,
+             restarts=64, steps=500, rate=0.1, seed=None, start=None):
+
+    if prepare and K is not None:
+        raise ValueError("prepare=True optimizes the state, so K comes from state_correlations()")
+
+    rng = np.random.default_rng(seed)
+    x = rng.uniform(-np.pi, np.pi, size=(restarts, 4))
+    if start is not None:
+        x[0] = [start[name] for name in ['A0', 'A1', 'B0', 'B1']]
+    theta = rng.uniform(0, np.pi / 2, size=restarts) if prepare else np.pi / 4
+
+    if K is None:
+        K, dK = state_correlations(theta, depolarizing, readout)
+
+    # Plain gradient ascent, S is smooth and its curvature is at most a few, so a fixed step works
+    for _ in range(steps):
+        if prepare:
+            K, dK = state_correlations(theta, depolarizing, readout)
+            S, gradient = S_gradient(x, K)
+            (uA0, _), (uA1, _), (vB0, _), (vB1, _) = [basis(x[..., i]) for i in range(4)]
+            theta = theta + rate * (np.einsum('...i,...ij,...j->...', uA0, dK, vB0 - vB1)
+                                    + np.einsum('...i,...ij,...j->...', uA1, dK, vB0 + vB1))
+        else:
+            S, gradient = S_gradient(x, K)
+        x = x + rate * gradient
+
+    if prepare:
+        K, _ = state_correlations(theta, depolarizing, readout)
+    S, _ = S_gradient(x, K)
+    best = int(np.argmax(S))
+
+    # Wrap the angles into (-π, π]
+    angles = -((-x[best] + np.pi) % (2 * np.pi) - np.pi)
+
+    result = dict(zip(['A0', 'A1', 'B0', 'B1'], angles.tolist()))
+    if prepare:
+        result['theta'] = float(theta[best])
+    result['S'] = float(S[best])
+    return result
+
+
+if __name__ == "__main__":
+    print(f"S   = {CHSH():.10f}...")
+    print(f"2√2 = {2*np.sqrt(2):.10f}...")
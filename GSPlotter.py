@@ -1,7 +1,8 @@
 ##############################################################################
 import os
+import time
 from pathlib import Path
-import matplotlib.pyplot as plt
+import numpy as np
 
 
 ### GSPlotter ###
@@ -31,6 +32,12 @@ gsp.plotter(
     line_styles=["-", "--", ":"],           # Three random linestyles   *optional*
     scale='linear'                          # How you view the data     *optional*
 )
+
+
+For very large data use gsp.bulk_plotter() with the same arguments.
+  It takes NumPy arrays (or memory-mapped arrays) instead of lists,
+  thins out series with millions of points without losing their peaks,
+  and turns repeated x-values into a mean with error bars.
 """
 
 # List of line colors for matplotlib
@@ -86,6 +93,10 @@ def setup_plot(title, xlabel, ylabel, scale):
         Returns fig and ax
     """
 
+    # matplotlib is imported here instead of at the top so that
+    #   importing GSPlotter doesn't pay for it until something is plotted
+    import matplotlib.pyplot as plt
+
     # Create a figure and a set of subplots.
     # This is the standard object-oriented way to make a plot.
     # figsize determines the shape of the figure, for more details
@@ -111,7 +122,7 @@ def setup_plot(title, xlabel, ylabel, scale):
 # They shouldn't be used, but it's nice to have to avoid weird errors
 def plotter(x_values, y_values, plot_labels, title, scale='linear',
             xlabel="x-axis", ylabel="y-axis", filename='Default_Filename.png',
-            colors=default_color_list, line_styles=default_line_styles):
+            colors=default_color_list, line_styles=default_line_styles, errors=None):
     """
     plotter()
 
@@ -145,6 +156,9 @@ def plotter(x_values, y_values, plot_labels, title, scale='linear',
     # Name of the file you want the plot to be called
     filename
 
+    # Optional error bars, a list with one list of errors per line (None for no error bars)
+    errors
+
     Output:
     returns figure, which is to be passed into plotter()
     """
@@ -189,6 +203,12 @@ def plotter(x_values, y_values, plot_labels, title, scale='linear',
         #   would be n = 3 since there are 3 items in the outer list
         ax.plot(x, y, linestyle=line_style, color=color, label=label)
 
+    # Error bars are drawn on top of the lines, in the same color
+    if errors is not None:
+        for x, y, error, color in zip(x_values, y_values, errors, colors):
+            if error is not None:
+                ax.errorbar(x, y, yerr=error, fmt="none", ecolor=color, capsize=3)
+
     # We want a legend, let's put it at the top right semi-arbitrarily
     # It's best to do this after plotting the data with labels
     ax.legend(loc="upper right")
@@ -204,6 +224,334 @@ def plotter(x_values, y_values, plot_labels, title, scale='linear',
     return
 
 
+##############################################################################
+### Large Data ###
+
+
+def decimate(x, y, bins=5000):
+    """
+    decimate()
+
+    Thins a series down to at most about 2*bins points for plotting.
+    The points are split into bins equal groups, and only the lowest and
+        highest point of each group is kept, so spikes don't disappear.
+
+    Parameters:
+        x, y - arrays of the same length, x sorted
+        bins - int -> number of groups
+
+    Output:
+        Returns the kept x and y
+    """
+
+    x = np.asarray(x)
+    y = np.asarray(y)
+
+    n = len(y)
+    if n <= 2 * bins:
+        return x, y
+
+    # Only the first bins*size points fit evenly into groups,
+    #   the few that are left over are all kept
+    size = n // bins
+    groups = y[:bins * size].reshape(bins, size)
+    start = np.arange(bins) * size
+
+    lowest = start + groups.argmin(axis=1)
+    highest = start + groups.argmax(axis=1)
+    leftover = np.arange(bins * size, n)
+
+    # np.unique also sorts the points back into their original order
+    keep = np.unique(np.concatenate([lowest, highest, leftover]))
+
+    return x[keep], y[keep]
+
+
+def aggregate(x, y):
+    """
+    aggregate()
+
+    Combines repeated x-values (i.e. repetitions of the same run)
+        into their mean and the standard error of that mean.
+
+    Parameters:
+        x, y - arrays of the same length
+
+    Output:
+        Returns the unique x, the mean y and the standard error of each
+        (the standard error is 0 for x-values that only appear once)
+    """
+
+    x = np.asarray(x)
+    y = np.asarray(y, dtype=float)
+
+    # inverse says which unique x each point belongs to
+    unique_x, inverse, counts = np.unique(x, return_inverse=True, return_counts=True)
+
+    # bincount adds up the y-values of each unique x in one pass
+    total = np.bincount(inverse, weights=y)
+    mean = total / counts
+
+    # Sample variance, (sum of squared deviations) / (n - 1)
+    deviations = np.bincount(inverse, weights=(y - mean[inverse])**2)
+    variance = np.divide(deviations, counts - 1, out=np.zeros_like(mean), where=counts > 1)
+    error = np.sqrt(variance / counts)
+
+    return unique_x, mean, error
+
+
+def setup_headless_plot(title, xlabel, ylabel, scale, dpi=100):
+    """
+    setup_headless_plot()
+
+    The same as setup_plot(), but draws straight into an image with the Agg
+        backend instead of going through pyplot, so nothing is shown on
+        screen and no pyplot figures pile up in memory.
+
+    Output:
+        Returns fig and ax
+    """
+
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    fig = Figure(figsize=(12, 6), dpi=dpi)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+
+    ax.set_title(title, fontsize=14, weight="bold")
+    ax.set_xlabel(xlabel, fontsize=12)
+    ax.set_ylabel(ylabel, fontsize=12)
+
+    ax.grid(True, linestyle="--", alpha=0.7)
+
+    ax.set_xscale(scale)
+    ax.set_yscale(scale)
+
+    return fig, ax
+
+
+def bulk_plotter(x_values, y_values, plot_labels, title, scale='linear',
+                 xlabel="x-axis", ylabel="y-axis", filename='Default_Filename.png',
+                 colors=default_color_list, line_styles=default_line_styles,
+                 repeats=True, bins=5000, errors=None):
+    """
+    bulk_plotter()
+
+    plotter() for large data. Takes the same arguments as plotter(),
+        but every series can be a NumPy array or a memory-mapped array.
+
+    Extra parameters:
+    # If True, repeated x-values in a series are drawn as their mean
+    #   with standard error bars instead of as separate points
+    repeats
+
+    # Series longer than 2*bins points are thinned out with decimate()
+    bins
+
+    # Optional error bars, one array of errors per series (None for no error bars)
+    #   A series with its own errors isn't averaged over repeats
+    errors
+
+    Output:
+    Saves the figure to plots/filename
+    """
+
+    from matplotlib.collections import LineCollection
+
+    plots_path = Path("plots")
+    plots_path.mkdir(exist_ok=True)
+
+    fig, ax = setup_headless_plot(title, xlabel, ylabel, scale=scale)
+
+    if errors is None:
+        errors = [None] * len(x_values)
+
+    for x, y, error, label, color, line_style in zip(x_values, y_values, errors, plot_labels, colors, line_styles):
+
+        # Sort by x so the line is drawn left to right
+        x = np.asarray(x)
+        y = np.asarray(y)
+        order = np.argsort(x, kind="stable")
+        x = x[order]
+        y = y[order]
+
+        if error is not None:
+            error = np.asarray(error)[order]
+            ax.errorbar(x, y, yerr=error, fmt="none", ecolor=color, capsize=3)
+        elif repeats:
+            x, y, error = aggregate(x, y)
+            if np.any(error > 0):
+                ax.errorbar(x, y, yerr=error, fmt="none", ecolor=color, capsize=3)
+
+        x, y = decimate(x, y, bins)
+
+        # A LineCollection draws the whole series as one object,
+        #   which is much faster than ax.plot for millions of points
+        line = LineCollection([np.column_stack([x, y])], colors=color,
+                              linestyles=line_style, label=label)
+        ax.add_collection(line)
+
+    # Collections don't rescale the axes by themselves
+    ax.autoscale_view()
+
+    ax.legend(loc="upper right")
+    fig.tight_layout()
+
+    fig.savefig(os.path.join("./plots", filename), dpi=200)
+
+    return
+
+
+def store_plotter(store, x_column, y_columns, plot_labels, title, **kwargs):
+    """
+    store_plotter()
+
+    bulk_plotter() for data saved in a Store (see Store.py).
+    The columns are memory-mapped, so they are never loaded into lists.
+
+    Parameters:
+    # The store to read from
+    store
+
+    # Name of the column along the x-axis
+    x_column
+
+    # Names of the columns along the y-axis, one per line
+    #   A number instead of a name draws a flat reference line at that value
+    y_columns
+
+    Everything else is passed on to bulk_plotter()
+    """
+
+    x = store.column(x_column)
+
+    y_values = []
+    for y in y_columns:
+        if isinstance(y, str):
+            y_values.append(store.column(y))
+        else:
+            y_values.append(np.full(len(x), y, dtype=float))
+
+    bulk_plotter([x] * len(y_values), y_values, plot_labels, title, **kwargs)
+
+
+##############################################################################
+### Live Plotting ###
+
+
+class LivePlotter:
+    """
+    LivePlotter
+
+    A plot that grows while the data comes in, i.e. during a long sweep.
+    The figure and its lines are made once and kept, new points are added
+        with append(), and every interval seconds the image in plots/ is updated.
+
+    Only the lines are redrawn on an update. The rest of the figure (axes,
+        grid, labels, legend) is drawn once and reused, unless the new points
+        change the axis limits.
+
+    Usage:
+        live = gsp.LivePlotter(plot_labels=["S", "2√2"], title="Sweep", filename="live.png")
+        live.append("S", 1024, 2.81)
+        ...
+        live.close()
+
+    Parameters: The same as plotter(), plus
+        interval - float -> seconds between updates of the image
+    """
+
+    def __init__(self, plot_labels, title, scale='linear',
+                 xlabel="x-axis", ylabel="y-axis", filename='Default_Filename.png',
+                 colors=default_color_list, line_styles=default_line_styles,
+                 interval=30):
+
+        plots_path = Path("plots")
+        plots_path.mkdir(exist_ok=True)
+        self.path = os.path.join("./plots", filename)
+
+        # dpi=200 to match the images saved by plotter()
+        self.fig, self.ax = setup_headless_plot(title, xlabel, ylabel, scale=scale, dpi=200)
+
+        # One line per label, with no points yet
+        # animated=True leaves the lines out of the full redraws, they are drawn on top separately
+        self.lines = {}
+        self.data = {}
+        for label, color, line_style in zip(plot_labels, colors, line_styles):
+            line, = self.ax.plot([], [], linestyle=line_style, color=color, label=label, animated=True)
+            self.lines[label] = line
+            self.data[label] = ([], [])
+
+        self.ax.legend(loc="upper right")
+
+        self.interval = interval
+        self.changed = set()
+        self.background = None
+        self.limits = None
+        self.last_flush = time.monotonic()
+
+    def append(self, label, x, y):
+        """
+        Adds the point (x, y) to the line called label.
+        The image is updated if it's been at least interval seconds since the last update.
+        """
+
+        xs, ys = self.data[label]
+        xs.append(x)
+        ys.append(y)
+        self.changed.add(label)
+
+        if time.monotonic() - self.last_flush >= self.interval:
+            self.flush()
+
+    def flush(self):
+        """
+        Updates the image in plots/ with every point added so far.
+        """
+
+        self.last_flush = time.monotonic()
+        if not self.changed:
+            return
+
+        # Only the lines that got new points need new data
+        # The points can arrive in any order, so they are sorted by x to draw the line left to right
+        for label in self.changed:
+            xs, ys = self.data[label]
+            order = np.argsort(xs, kind="stable")
+            self.lines[label].set_data(np.asarray(xs)[order], np.asarray(ys)[order])
+        self.changed.clear()
+
+        self.ax.relim()
+        self.ax.autoscale_view()
+        limits = (self.ax.get_xlim(), self.ax.get_ylim())
+
+        canvas = self.fig.canvas
+        if limits != self.limits:
+            # The axes moved, so everything except the lines has to be drawn again
+            self.fig.tight_layout()
+            canvas.draw()
+            self.background = canvas.copy_from_bbox(self.fig.bbox)
+            self.limits = limits
+        else:
+            # Reuse the saved axes, grid and labels
+            canvas.restore_region(self.background)
+
+        for line in self.lines.values():
+            self.ax.draw_artist(line)
+
+        # Save what is on the canvas as it is, without drawing it all over again
+        from matplotlib.image import imsave
+        imsave(self.path, np.asarray(canvas.buffer_rgba()))
+
+    def close(self):
+        """
+        Writes the final image.
+        """
+
+        self.flush()
+
+
 if __name__ == "__main__":
     print("Please see usage instructions at the top of GSPlotter.py")
     print("This program is not meant to be run, please import it")
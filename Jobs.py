@@ -0,0 +1,236 @@
+import asyncio
+import json
+import os
+import pickle
+import random
+import time
+import uuid
+from pathlib import Path
+
+# This program keeps track of jobs sent to IBM Quantum while they wait in the queue.
+#
+# Instead of waiting on one job.result() at a time, every job is polled at the same time,
+#   and each result is handed back as soon as its job finishes, whatever order that happens in.
+# Polling starts every interval seconds and slows down by backoff each time a job isn't done yet,
+#   up to max_interval, so long queues aren't asked about every second.
+#
+# The job IDs are written to a JSON file as soon as they're sent, so if the program is stopped
+#   it can be started again with the same file and pick the unfinished jobs back up.
+#
+# A job that can't be re-attached or fails to return its result is recorded as an ERROR,
+#   with the reason, without stopping the other jobs.
+#
+# i.e.
+#   manager = JobManager(service, "jobs.json")
+#   manager.track(jobs, ["S"])
+#   async for job_id, status, result in manager.results():
+#       ...
+
+
+# Job statuses that mean the job won't change anymore
+finished = {"DONE", "ERROR", "CANCELLED"}
+
+
+# Function to turn a job status into its name
+# IBM Quantum jobs return strings, local jobs return a JobStatus enum
+def status_name(status):
+    return getattr(status, "name", str(status)).upper()
+
+
+class JobManager:
+
+    # service is what jobs are re-attached with, a QiskitRuntimeService or LocalService
+    # path is the JSON file the job IDs are kept in, None to not keep them
+    def __init__(self, service, path=None, interval=1.0, backoff=2.0, max_interval=60.0):
+        self.service = service
+        self.path = None if path is None else Path(path)
+        self.interval = interval
+        self.backoff = backoff
+        self.max_interval = max_interval
+
+        # job ID -> {"names": observable names, "status": last status seen}
+        self.records = {}
+        # job ID -> job object, only for jobs sent or re-attached by this process
+        self.jobs = {}
+
+        if self.path is not None and self.path.exists():
+            with open(self.path) as file:
+                self.records = json.load(file)["jobs"]
+
+    # Rename a finished temporary file over the old one, so the file is never half written
+    def write(self):
+        if self.path is None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = self.path.with_suffix(".tmp")
+        with open(temporary, "w") as file:
+            json.dump({"jobs": self.records}, file, indent=2)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, self.path)
+
+    # Function to start keeping track of jobs that have just been sent
+    # names are the observables in every pub, in the order they were sent
+    def track(self, jobs, names):
+        for job in jobs:
+            self.jobs[job.job_id()] = job
+            self.records[job.job_id()] = {"names": list(names), "status": "QUEUED"}
+        self.write()
+
+    # IDs of the jobs that haven't finished yet, including ones sent before a restart
+    def pending(self):
+        return [job_id for job_id, record in self.records.items() if record["status"] not in finished]
+
+    def job(self, job_id):
+        if job_id not in self.jobs:
+            self.jobs[job_id] = self.service.job(job_id)
+        return self.jobs[job_id]
+
+    # Function to poll one job until it's finished
+    # The blocking calls run in a thread so the other jobs keep being polled in the meantime
+    # A job that can't be found or fails to return its result counts as an ERROR,
+    #   so one bad job doesn't stop the others from being followed
+    async def wait(self, job_id):
+        try:
+            job = await asyncio.to_thread(self.job, job_id)
+
+            delay = self.interval
+            while True:
+                status = status_name(await asyncio.to_thread(job.status))
+                if status in finished:
+                    break
+                await asyncio.sleep(delay)
+                delay = min(delay * self.backoff, self.max_interval)
+
+            result = await asyncio.to_thread(job.result) if status == "DONE" else None
+        except Exception as error:
+            self.records[job_id]["error"] = f"{type(error).__name__}: {error}"
+            return job_id, "ERROR", None
+
+        return job_id, status, result
+
+    # Function to yield (job ID, status, result) for every unfinished job, in the order they finish
+    # result is None if the job failed or was cancelled
+    async def results(self):
+        tasks = [asyncio.create_task(self.wait(job_id)) for job_id in self.pending()]
+
+        for task in asyncio.as_completed(tasks):
+            job_id, status, result = await task
+            self.records[job_id]["status"] = status
+            self.write()
+            yield job_id, status, result
+
+    def names(self, job_id):
+        return self.records[job_id]["names"]
+
+    # The reason a job ended up as an ERROR here, or None
+    def error(self, job_id):
+        return self.records[job_id].get("error")
+
+
+#############################
+#       Local Service       #
+#############################
+
+# Stand-in for QiskitRuntimeService that runs jobs on a local fake backend
+# Every job waits a random time in a pretend queue first, latency seconds on average,
+#   so the job manager can be tried out without an IBM Quantum account.
+# With a directory, every job's pubs (and its result, once it has one) are saved there under its ID,
+#   so jobs can be re-attached after a restart, like real ones. Without one they only live as long
+#   as the LocalService.
+class LocalService:
+
+    def __init__(self, backend, latency=5.0, seed=None, directory=None):
+        self.backend = backend
+        self.latency = latency
+        self.random = random.Random(seed)
+        self.directory = None if directory is None else Path(directory)
+        self.jobs = {}
+
+    # Function to send a list of pubs, like EstimatorV2.run
+    def run(self, pubs):
+        # The pretend queue is kept in wall clock time, so it carries on across restarts
+        ready = time.time() + (self.random.expovariate(1 / self.latency) if self.latency > 0 else 0)
+        job = LocalJob(f"local-{uuid.uuid4().hex[:12]}", ready, self.backend, pubs, self.directory)
+        job.save()
+        self.jobs[job.job_id()] = job
+        return job
+
+    def job(self, job_id):
+        if job_id not in self.jobs:
+            if self.directory is None or not LocalJob.path(self.directory, job_id).exists():
+                raise KeyError(f"No local job {job_id}, keep local jobs in a directory to find them after a restart")
+            self.jobs[job_id] = LocalJob.load(self.directory, job_id, self.backend)
+        return self.jobs[job_id]
+
+
+class LocalJob:
+
+    # The job is only sent to the fake backend once it's out of the pretend queue
+    def __init__(self, job_id, ready, backend, pubs, directory=None, result=None):
+        self.id = job_id
+        self.ready = ready
+        self.backend = backend
+        self.pubs = pubs
+        self.directory = directory
+        self.job = None
+        self.saved_result = result
+
+    @staticmethod
+    def path(directory, job_id, suffix=""):
+        return Path(directory) / f"{job_id}{suffix}.pkl"
+
+    # Function to save the job's pubs, so it can be loaded again by its ID
+    def save(self):
+        if self.directory is None:
+            return
+        self.write(self.path(self.directory, self.id), {"ready": self.ready, "pubs": self.pubs})
+
+    # Function to load a saved job, and its result if it had finished
+    @classmethod
+    def load(cls, directory, job_id, backend):
+        with open(cls.path(directory, job_id), "rb") as file:
+            saved = pickle.load(file)
+        try:
+            with open(cls.path(directory, job_id, ".result"), "rb") as file:
+                result = pickle.load(file)
+        except FileNotFoundError:
+            result = None
+        return cls(job_id, saved["ready"], backend, saved["pubs"], directory, result)
+
+    # Rename a finished temporary file over the old one, so the file is never half written
+    def write(self, path, data):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(temporary, "wb") as file:
+            pickle.dump(data, file)
+        os.replace(temporary, path)
+
+    def start(self):
+        from qiskit_ibm_runtime import EstimatorV2 as Estimator
+        return Estimator(mode=self.backend).run(pubs=self.pubs)
+
+    def job_id(self):
+        return self.id
+
+    def status(self):
+        if self.saved_result is not None:
+            return "DONE"
+        if time.time() < self.ready:
+            return "QUEUED"
+        if self.job is None:
+            self.job = self.start()
+        return status_name(self.job.status())
+
+    def result(self):
+        if self.saved_result is not None:
+            return self.saved_result
+
+        time.sleep(max(0.0, self.ready - time.time()))
+        if self.job is None:
+            self.job = self.start()
+        self.saved_result = self.job.result()
+
+        if self.directory is not None:
+            self.write(self.path(self.directory, self.id, ".result"), self.saved_result)
+        return self.saved_result
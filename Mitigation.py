@@ -0,0 +1,151 @@
+import json
+import time
+import numpy as np
+import Cache
+import Counts
+import Noise
+
+# Readout error makes the measured outcome differ from the one the qubits were actually in,
+#   which pulls every E (and so S) towards 0. This program measures that error and undoes it.
+#
+# Calibration prepares each of |00>, |01>, |10>, |11> and measures it. The fraction of times
+#   `measured` was read when `prepared` was prepared fills the 4x4 assignment matrix
+#
+#   M[measured, prepared]
+#
+# so the measured probabilities are p_measured = M @ p_true, and the true ones are found by
+#   solving that for p_true. This is done for whole arrays of counts at once (see Counts.py).
+#
+# The matrix is saved in .chsh_cache/calibrations/ (see Cache.py), so the calibration only runs
+#   once per noise model. Calibrations older than max_age are run again, because real devices drift.
+
+
+calibration_dir = Cache.cache_dir / "calibrations"
+
+# How long a calibration is used for, in seconds (1 day)
+max_age = 24 * 60 * 60
+
+
+# Function to return the four calibration circuits, preparing |00>, |01>, |10>, |11> in that order
+# The bits are measured into the same classical bits as the CHSH circuits, Alice (qubit 0) is the lowest bit
+def circuits():
+    from qiskit import QuantumCircuit
+
+    qcs = []
+    for prepared in range(4):
+        qc = QuantumCircuit(2, 2)
+        for qubit in range(2):
+            if prepared >> qubit & 1:
+                qc.x(qubit)
+        qc.measure([0, 1], [0, 1])
+        qcs.append(qc)
+    return qcs
+
+
+# Function to return the physical qubits the CHSH circuits are placed on
+# Every qubit of a device snapshot has its own readout error, so the calibration has to use the same ones
+def qubits(noise):
+    if 'backend' not in noise:
+        return None
+
+    from qiskit import transpile
+    import Aer_Qasm
+
+    qc = transpile(Aer_Qasm.circuits()[0], Noise.simulator(noise))
+    return qc.layout.final_index_layout()[:2]
+
+
+# Function to run the calibration circuits and return the assignment matrix
+# shots=None gives the exact matrix from one density matrix run (see Noise.probabilities)
+def calibrate(noise, shots=None, seed=None):
+    layout = qubits(noise)
+
+    if shots is None:
+        # One row of probabilities per prepared state, so it's transposed into M[measured, prepared]
+        return Noise.probabilities(circuits(), noise, layout).T
+
+    from qiskit import transpile
+
+    backend = Noise.simulator(noise)
+    options = {} if seed is None else {'seed_simulator': seed}
+    result = backend.run(transpile(circuits(), backend, initial_layout=layout), shots=shots, **options).result()
+
+    counts = Counts.to_array([result.get_counts(i) for i in range(4)])
+    return (counts / counts.sum(axis=-1, keepdims=True)).T
+
+
+def calibration_path(noise, shots):
+    return calibration_dir / f"{Cache.key({'noise': noise, 'shots': shots})}.json"
+
+
+# Function to return the assignment matrix of a noise model, calibrating it only if needed
+# Without a noise model nothing is ever read wrong, so the matrix is the identity
+def matrix(noise=None, shots=None, seed=None, cache=True):
+
+    if not noise:
+        return np.eye(4)
+
+    path = calibration_path(noise, shots)
+
+    if cache:
+        try:
+            with open(path) as file:
+                entry = json.load(file)
+            if time.time() - entry['created'] < max_age:
+                return np.array(entry['matrix'])
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+
+    M = calibrate(noise, shots, seed)
+
+    if cache:
+        entry = {'noise': noise, 'shots': shots, 'created': time.time(), 'matrix': M.tolist()}
+        Cache.write_atomic(path, json.dumps(entry).encode())
+
+    return M
+
+
+# Function to undo the readout error of counts with any number of leading axes, i.e. (n, 4, 4)
+# method='inverse' multiplies by the inverse of M, method='lstsq' solves by least squares,
+#   which also works when M is (close to) singular
+# The corrected probabilities can come out slightly negative, clip=True sets those to 0
+#   and renormalizes so every E stays between -1 and 1
+# Returns corrected counts as floats with the same totals, so Counts.expectation and Counts.S work on them
+def correct(array, M, method='inverse', clip=True):
+    array = np.asarray(array)
+    totals = array.sum(axis=-1, keepdims=True)
+
+    # Every experiment as one row of measured probabilities
+    measured = (array / totals).reshape(-1, 4)
+
+    if method == 'inverse':
+        true = measured @ np.linalg.inv(M).T
+    elif method == 'lstsq':
+        true = np.linalg.lstsq(M, measured.T, rcond=None)[0].T
+    else:
+        raise ValueError(f"Unknown method {method!r}, expected 'inverse' or 'lstsq'")
+
+    if clip:
+        true = np.clip(true, 0, None)
+        true /= true.sum(axis=-1, keepdims=True)
+
+    return true.reshape(array.shape) * totals
+
+
+# Function to return the standard error of the mitigated S, see Counts.standard_error
+# Every corrected E is a weighted sum of the measured frequencies, E = w · q with w = M^-T parity,
+#   so it has variance (Σ q w² - (Σ q w)²)/N. Undoing the readout error makes w larger than
+#   the ±1 of the parity, so the mitigated S is less certain than the raw one.
+def standard_error(array, M):
+    array = np.asarray(array)
+    totals = array.sum(axis=-1)
+    measured = array / totals[..., None]
+
+    w = np.linalg.inv(M).T @ Counts.parity
+    variance = (measured @ w**2 - (measured @ w)**2) / totals
+    return np.sqrt(variance.sum(axis=-1))
+
+
+# Function to calculate the mitigated S of every run at once, see Counts.S
+def S(array, noise=None, method='inverse', shots=None):
+    return Counts.S(correct(array, matrix(noise, shots), method))
@@ -0,0 +1,129 @@
+import numpy as np
+
+# The Qasm simulator on its own is ideal, the only "noise" in its results is shot noise.
+# This program adds noise models that behave more like real hardware.
+#
+# A noise model is described by a small dictionary so it can be typed on the command line
+#   and saved alongside the results (see Cache.py), for example:
+#
+#   {'depolarizing': 0.01}                  1% depolarizing error on every gate
+#   {'readout': 0.02}                       2% chance of reading each qubit wrong
+#   {'depolarizing': 0.01, 'readout': 0.02} both
+#   {'backend': 'FakeSherbrooke'}           the noise of a local snapshot of an IBM device
+#
+# The fake backends come from qiskit_ibm_runtime.fake_provider and don't need an IBM account.
+#
+# Qiskit is only imported inside the functions that need it, so parse() stays fast.
+
+
+# Function to turn the text form "depolarizing=0.01,readout=0.02" into the dictionary form
+def parse(text):
+    noise = {}
+    for item in text.split(','):
+        name, value = item.split('=')
+        name = name.strip()
+        noise[name] = value.strip() if name == 'backend' else float(value)
+    return noise
+
+
+# Function to return the fake backend with the given name, i.e. 'FakeSherbrooke'
+def fake_backend(name):
+    from qiskit_ibm_runtime import fake_provider
+    return getattr(fake_provider, name)()
+
+
+# Function to build the Aer noise model described by noise
+def noise_model(noise):
+    from qiskit_aer.noise import NoiseModel, ReadoutError, depolarizing_error
+
+    if 'backend' in noise:
+        return NoiseModel.from_backend(fake_backend(noise['backend']))
+
+    model = NoiseModel()
+
+    # Depolarizing error replaces the state with a completely random one with probability p
+    # It is added to the gates the CHSH circuits actually use
+    p = noise.get('depolarizing', 0)
+    if p:
+        model.add_all_qubit_quantum_error(depolarizing_error(p, 1), ['h', 'ry'])
+        model.add_all_qubit_quantum_error(depolarizing_error(p, 2), ['cx'])
+
+    # Readout error flips the measured bit with probability q
+    q = noise.get('readout', 0)
+    if q:
+        model.add_all_qubit_readout_error(ReadoutError([[1 - q, q], [q, 1 - q]]))
+
+    return model
+
+
+# Function to return an Aer simulator that applies the noise model
+# Any keyword, e.g. method='density_matrix', is passed on to AerSimulator
+def simulator(noise, **options):
+    from qiskit_aer import AerSimulator
+
+    # from_backend also copies the device's connectivity and native gates,
+    #   so circuits transpiled for it end up on real physical qubits
+    if 'backend' in noise:
+        return AerSimulator.from_backend(fake_backend(noise['backend']), **options)
+
+    return AerSimulator(noise_model=noise_model(noise), **options)
+
+
+# Function to return the 2x2 readout matrix of each qubit in qubits
+# M[measured, prepared] is the chance of reading `measured` when the qubit was `prepared`
+def readout_matrices(noise, qubits):
+
+    if 'backend' in noise:
+        # The device snapshot stores the readout error of every physical qubit
+        target = fake_backend(noise['backend']).target
+        errors = [target['measure'][(qubit,)].error or 0 for qubit in qubits]
+    else:
+        errors = [noise.get('readout', 0)] * len(qubits)
+
+    return [np.array([[1 - e, e], [e, 1 - e]]) for e in errors]
+
+
+##################
+#   Exact Mode   #
+##################
+
+# Sampling noisy shots one by one is slow, but for 2 qubits the noisy state is only a 4x4 density matrix.
+# The density matrix method of Aer applies every gate error exactly, without any sampling,
+#   so one run gives the exact outcome probabilities, and the readout error is applied on top of them.
+
+# Function to return the exact noisy outcome probabilities of measured 2-qubit circuits
+# The output has shape (number of circuits, 4), ordered |00>, |01>, |10>, |11>
+# initial_layout places the qubits on given physical qubits, i.e. [5, 6], instead of letting the transpiler pick
+def probabilities(qcs, noise, initial_layout=None):
+    from qiskit import transpile
+
+    backend = simulator(noise, method='density_matrix')
+
+    # The measurements are replaced by saving the density matrix
+    unmeasured = [qc.remove_final_measurements(inplace=False) for qc in qcs]
+    transpiled_qcs = transpile(unmeasured, backend, initial_layout=initial_layout)
+
+    probs = []
+    readouts = []
+    for qc in transpiled_qcs:
+
+        # The physical qubits Alice and Bob were placed on by the transpiler
+        qubits = [0, 1] if qc.layout is None else qc.layout.final_index_layout()[:2]
+
+        # Saves the 2-qubit density matrix of Alice and Bob (Alice is the lowest bit)
+        qc.save_density_matrix(qubits=qubits, label='rho')
+        readouts.append(readout_matrices(noise, qubits))
+
+    result = backend.run(transpiled_qcs, shots=1).result()
+
+    for i, (alice_readout, bob_readout) in enumerate(readouts):
+        rho = np.asarray(result.data(i)['rho'])
+
+        # The diagonal of the density matrix is the probability of each outcome
+        prob = np.real(np.diag(rho))
+
+        # Apply the readout error, Bob's matrix goes first because he is the highest bit
+        prob = np.kron(bob_readout, alice_readout) @ prob
+        probs.append(prob)
+
+    return np.array(probs)
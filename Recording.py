@@ -0,0 +1,304 @@
+import argparse
+import json
+from pathlib import Path
+import numpy as np
+import Cache
+import Counts
+import Noise
+
+# Counts only say how often each outcome happened, not when. To look for drift over a run,
+#   or correlations between one shot and the next, every single outcome has to be kept.
+#
+# Aer can return every shot as a string ('01', '11', ...), but at 2^29 shots that's hundreds of
+#   millions of Python strings. An outcome is only 2 bits though (Alice is the low bit, like in
+#   Counts.py), so this program packs 4 shots into every byte:
+#
+#   byte = shot_0 | shot_1 << 2 | shot_2 << 4 | shot_3 << 6
+#
+# A recording is a directory with
+#   outcomes.npy     uint8 array of shape (4 settings, bytes), ordered like Aer_Qasm.measurement_settings
+#   recording.json   what was recorded, and how many shots are done so far
+#
+# The outcomes are memory-mapped and written chunk shots at a time, so neither the recording
+#   nor Aer's strings ever have to fit in memory at once, and a stopped recording carries on
+#   where it left off. Every chunk has its own seed spawned from the recording's seed, so a
+#   resumed recording gives the same outcomes as one that ran straight through.
+#
+# The readers work on the packed bytes directly: a 256 entry table turns every byte into the
+#   counts of its 4 shots, so the counts, E and S of every window of shots come out as arrays
+#   (see Counts.py) without unpacking a single shot.
+#
+#   python Recording.py record runs/drift --shots 268435456 --sampler --seed 1
+#   python Recording.py windows runs/drift --window 1048576
+
+
+# The counts of each outcome among the 4 shots of every possible byte, shape (256, 4)
+byte_counts = np.stack([((np.arange(256)[:, None] >> 2 * np.arange(4)) & 3 == outcome).sum(axis=1)
+                        for outcome in range(4)], axis=1).astype(np.uint8)
+
+
+def spec_path(directory):
+    return Path(directory) / "recording.json"
+
+
+def outcomes_path(directory):
+    return Path(directory) / "outcomes.npy"
+
+
+# Function to pack outcomes (0 to 3) along the last axis, 4 shots per byte
+# The last byte is padded with 00 outcomes, the shot count in the spec says where the shots end
+def pack(outcomes):
+    outcomes = np.asarray(outcomes, dtype=np.uint8)
+    padding = -outcomes.shape[-1] % 4
+    if padding:
+        outcomes = np.concatenate([outcomes, np.zeros(outcomes.shape[:-1] + (padding,), np.uint8)], axis=-1)
+
+    shots = outcomes.reshape(outcomes.shape[:-1] + (-1, 4))
+    return shots[..., 0] | shots[..., 1] << 2 | shots[..., 2] << 4 | shots[..., 3] << 6
+
+
+# Function to unpack bytes back into outcomes, 4 per byte
+def unpack(packed):
+    packed = np.asarray(packed, dtype=np.uint8)
+    shots = (packed[..., None] >> np.array([0, 2, 4, 6], dtype=np.uint8)) & 3
+    return shots.reshape(packed.shape[:-1] + (-1,))
+
+
+# Function to draw the outcomes of every setting for one chunk from the exact probabilities
+# Returns a (4 settings, shots) array of outcomes
+# Every draw is a 32 bit integer, and its outcome is how many of the first three cumulative
+#   probabilities (scaled to 2^32) it reaches, which is much faster than searching with floats
+def sample_outcomes(probs, shots, seed):
+    rng = np.random.default_rng(seed)
+    thresholds = np.round(np.cumsum(probs, axis=-1)[:, :3] * 2**32).clip(0, 2**32 - 1).astype(np.uint32)
+
+    draws = rng.integers(0, 2**32, size=(len(probs), shots), dtype=np.uint32)
+    outcomes = np.zeros(draws.shape, dtype=np.uint8)
+    for i in range(3):
+        outcomes += draws >= thresholds[:, i, None]
+    return outcomes
+
+
+# Function to simulate the outcomes of every setting for one chunk with Aer
+# Aer's memory strings are turned into outcomes all at once, straight from their bytes
+def simulate_outcomes(backend, qcs, shots, seed, **options):
+    result = backend.run(qcs, shots=shots, memory=True, seed_simulator=seed, **options).result()
+
+    outcomes = []
+    for i in range(len(qcs)):
+        memory = result.get_memory(i)
+        text = np.frombuffer(''.join(memory).encode(), dtype=np.uint8).reshape(len(memory), -1)
+        # The last two characters are Bob's and Alice's bits, Bob is the high bit
+        outcomes.append(2 * (text[:, -2] - ord('0')) + (text[:, -1] - ord('0')))
+    return np.array(outcomes, dtype=np.uint8)
+
+
+def write_spec(directory, spec):
+    Cache.write_atomic(spec_path(directory), json.dumps(spec, indent=2).encode())
+
+
+def load_spec(directory):
+    with open(spec_path(directory)) as file:
+        return json.load(file)
+
+
+# Function to record every outcome of a run into directory, chunk shots at a time
+# sampler=True draws the outcomes from the exact probabilities (see Aer_Qasm.sample),
+#   otherwise Aer simulates them with a noise model if there is one
+# Running it again on an unfinished recording with the same arguments carries on where it stopped
+# A different recording already in directory is only replaced with overwrite=True
+# Any other keyword is passed on to the Aer simulator
+# Returns the (4, 4) counts of the whole recording
+def record(directory, shots, sampler=False, seed=None, noise=None, chunk=2**18, overwrite=False, **options):
+    import Aer_Qasm
+
+    if chunk % 4:
+        raise ValueError(f"chunk has to be a multiple of 4 so every chunk starts on a byte, got {chunk}")
+
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    # Round tripped through JSON so it compares equal to a saved one (tuples come back as lists)
+    spec = json.loads(json.dumps({
+        'shots': shots, 'sampler': sampler, 'seed': seed, 'noise': noise, 'chunk': chunk,
+        'angles': {name: float(angle) for name, angle in Aer_Qasm.angles.items()},
+        'settings': Aer_Qasm.measurement_settings}))
+
+    try:
+        saved = load_spec(directory)
+    except FileNotFoundError:
+        saved = None
+
+    # A recording of the same run, with the same seed or without asking for one, is carried on
+    same = saved is not None and seed in (None, saved['seed']) and \
+        all(saved[name] == value for name, value in spec.items() if name != 'seed')
+
+    if same:
+        # Carry on with the saved recording, including its seed
+        spec = saved
+        data = np.load(outcomes_path(directory), mmap_mode='r+')
+    else:
+        if (saved is not None or outcomes_path(directory).exists()) and not overwrite:
+            raise FileExistsError(f"{directory} already holds a different recording, "
+                                  f"use another directory or overwrite=True (--overwrite) to replace it")
+
+        # Without a seed a resumed recording couldn't match, so one is picked here and saved
+        if spec['seed'] is None:
+            spec['seed'] = int(np.random.SeedSequence().generate_state(1)[0])
+        spec['recorded'] = 0
+        data = np.lib.format.open_memmap(outcomes_path(directory), mode='w+', dtype=np.uint8,
+                                         shape=(len(Aer_Qasm.measurement_settings), -(-shots // 4)))
+        write_spec(directory, spec)
+
+    chunks = -(-shots // chunk)
+    seeds = [int(child.generate_state(1)[0]) for child in np.random.SeedSequence(spec['seed']).spawn(chunks)]
+
+    if sampler:
+        probs = Aer_Qasm.probabilities(noise)
+        probs = probs / probs.sum(axis=-1, keepdims=True)
+    else:
+        from qiskit import transpile
+        from qiskit_aer import AerSimulator
+
+        backend = Noise.simulator(noise) if noise else AerSimulator()
+        qcs = transpile(Aer_Qasm.circuits(), backend)
+
+    for i in range(spec['recorded'] // chunk, chunks):
+        start = i * chunk
+        size = min(chunk, shots - start)
+
+        if sampler:
+            outcomes = sample_outcomes(probs, size, seeds[i])
+        else:
+            outcomes = simulate_outcomes(backend, qcs, size, seeds[i], **options)
+
+        data[:, start // 4:start // 4 + -(-size // 4)] = pack(outcomes)
+        data.flush()
+
+        # Only counted as recorded once the bytes are on disk
+        spec['recorded'] = start + size
+        write_spec(directory, spec)
+
+    return counts(directory)
+
+
+# Function to return the spec and the memory-mapped packed outcomes of a recording
+def load(directory):
+    return load_spec(directory), np.load(outcomes_path(directory), mmap_mode='r')
+
+
+# Function to return the outcomes of one setting for shots start to stop, as an array of 0 to 3
+def outcomes(directory, setting, start=0, stop=None):
+    spec, data = load(directory)
+    stop = spec['recorded'] if stop is None else min(stop, spec['recorded'])
+
+    shots = unpack(data[setting, start // 4:-(-stop // 4)])
+    return shots[start % 4:start % 4 + stop - start]
+
+
+# Function to return the counts of every window of window shots, shape (windows, 4 settings, 4 outcomes)
+# window has to be a multiple of 4, the shots after the last whole window are left out
+# The bytes are read block_bytes of every setting at a time, so memory use doesn't grow with
+#   the recording or the window
+def window_counts(directory, window, block_bytes=2**21):
+    if window % 4:
+        raise ValueError(f"window has to be a multiple of 4 so windows start on a byte, got {window}")
+
+    spec, data = load(directory)
+    settings = data.shape[0]
+    window_bytes = window // 4
+    windows = spec['recorded'] // window
+    end = windows * window_bytes
+
+    result = np.zeros((windows, settings, 4), dtype=np.int64)
+    for start in range(0, end, block_bytes):
+        stop = min(start + block_bytes, end)
+        block = data[:, start:stop]
+
+        # Which windows the block touches, and where each of them starts inside the block
+        first = start // window_bytes
+        offsets = np.arange(first * window_bytes, stop, window_bytes) - start
+        offsets[0] = 0
+
+        if window_bytes >= 256:
+            # Long windows: how often every byte value appears in each window, with one bincount,
+            #   times the counts of every byte value
+            index = 256 * (np.arange(start, stop) // window_bytes - first)
+            for setting in range(settings):
+                histogram = np.bincount(index + block[setting], minlength=256 * len(offsets))
+                result[first:first + len(offsets), setting] += histogram.reshape(-1, 256) @ byte_counts
+        else:
+            # Short windows: every byte becomes the counts of its 4 shots, added up over each window
+            sums = np.add.reduceat(byte_counts[block], offsets, axis=1, dtype=np.int64)
+            result[first:first + len(offsets)] += sums.transpose(1, 0, 2)
+
+    return result
+
+
+# Function to return the E of every setting of every window, shape (windows, 4 settings)
+def window_expectations(directory, window):
+    return Counts.expectation(window_counts(directory, window))
+
+
+# Function to return the S of every window, shape (windows,)
+def window_S(directory, window):
+    return Counts.S(window_counts(directory, window))
+
+
+# Function to return the (4, 4) counts of every shot recorded so far
+# The whole recording is one window, rounded down to whole bytes, plus the few shots after it
+def counts(directory):
+    spec, data = load(directory)
+    whole = spec['recorded'] // 4 * 4
+
+    result = window_counts(directory, whole)[0] if whole else np.zeros((data.shape[0], 4), dtype=np.int64)
+    for setting in range(data.shape[0]):
+        result[setting] += np.bincount(outcomes(directory, setting, whole), minlength=4)
+    return result
+
+
+parser = argparse.ArgumentParser(
+    description="Record every CHSH shot as packed bits and read windowed E and S back from them"
+)
+commands = parser.add_subparsers(dest="command", required=True)
+
+record_parser = commands.add_parser("record", help="Record every outcome of a run")
+record_parser.add_argument("directory", help="Directory to keep the recording in")
+record_parser.add_argument("--shots", "-s", type=int, default=1048576, help="Shots per setting (default: 2^20)")
+record_parser.add_argument("--sampler", action="store_true", help="Draw the outcomes instead of simulating")
+record_parser.add_argument("--seed", type=int, default=None, help="Seed for the whole recording")
+record_parser.add_argument("--noise", "-n", type=Noise.parse, default=None, help="Noise model, see Noise.py")
+record_parser.add_argument("--chunk", type=int, default=2**18, help="Shots recorded at a time (default: 2^18)")
+record_parser.add_argument("--overwrite", action="store_true",
+                           help="Replace a different recording that's already in the directory")
+
+windows_parser = commands.add_parser("windows", help="Print E and S for every window of shots")
+windows_parser.add_argument("directory", help="Directory of the recording")
+windows_parser.add_argument("--window", "-w", type=int, default=1048576, help="Shots per window (default: 2^20)")
+
+
+def main(argv=None):
+    args = parser.parse_args(argv)
+
+    if args.command == "record":
+        S = Counts.S(record(args.directory, args.shots, args.sampler, args.seed, args.noise, args.chunk,
+                            args.overwrite))
+        print(f"Recorded {args.shots} shots of every setting to {args.directory}; S = {S:.10f}...")
+        return
+
+    array = window_counts(args.directory, args.window)
+    E = Counts.expectation(array)
+    values = Counts.S(array)
+    errors = Counts.standard_error(array)
+
+    for iterator, (E_i, S, error) in enumerate(zip(E, values, errors)):
+        print(f"{iterator * args.window}: E = {np.array2string(E_i, precision=4)}; S = {S:.6f} ± {error:.2e}")
+
+    # Without drift the windows only differ by shot noise, so their spread matches their errors
+    if len(values) > 1:
+        print(f"Spread of S over {len(values)} windows = {np.std(values, ddof=1):.2e}, "
+              f"expected from shot noise = {np.sqrt(np.mean(errors**2)):.2e}")
+
+
+if __name__ == "__main__":
+    main()
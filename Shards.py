@@ -0,0 +1,229 @@
+import argparse
+import json
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import numpy as np
+import Aer_Qasm
+import Counts
+import Data
+import Noise
+
+# This program splits a sweep into shards that can run on different machines.
+#
+# A sweep is described by a small JSON file in a shared directory. Every point of the sweep
+#   is cut into units of at most `chunk` shots, and the units are dealt out over the shards.
+# Every unit has its own seed, derived from the sweep's seed, so the units can run anywhere,
+#   in any order, and still give the same counts.
+#
+# Each shard writes the counts of its units to its own file in the directory. Counts of the same
+#   point just add up, so merging the shards gives exactly the counts, and S, of the whole sweep.
+# Every unit is saved as soon as it's done, so a shard that crashes only loses the unit it was running.
+# A point that fits in one unit uses the same seed as Data.py, so it gives the same S as a
+#   single machine run of the same sweep.
+#
+#   python Shards.py plan sweeps/big --shards 8 --seed 1
+#   python Shards.py run sweeps/big --shard 3        (on every machine, one shard each)
+#   python Shards.py local sweeps/big --processes 4  (or every shard on this machine)
+#   python Shards.py merge sweeps/big
+
+
+# Function to write the description of a sweep to directory/spec.json
+# chunk is the most shots a single unit runs, larger points are split into several units
+def plan(directory, shards, exponents=range(20, 30), repetitions=1, seed=None,
+         sampler=False, noise=None, chunk=2**24):
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    # Without a seed the shards couldn't agree on the units, so one is picked here and saved
+    if seed is None:
+        seed = int(np.random.SeedSequence().generate_state(1)[0])
+
+    spec = {'shards': shards, 'exponents': list(exponents), 'repetitions': repetitions,
+            'seed': seed, 'sampler': sampler, 'noise': noise, 'chunk': chunk}
+    with open(directory / "spec.json", "w") as file:
+        json.dump(spec, file, indent=2)
+    return spec
+
+
+def load_spec(directory):
+    with open(Path(directory) / "spec.json") as file:
+        return json.load(file)
+
+
+# Function to return every unit of the sweep as (point index, unit index, shots, seed)
+# Every shard works this out from the spec on its own, so they never have to talk to each other
+def units(spec):
+    points, shot_list, seeds = Data.grid(spec['exponents'], spec['repetitions'], spec['seed'])
+
+    result = []
+    for i, (shots, point_seed) in enumerate(zip(shot_list, seeds)):
+        sizes = [spec['chunk']] * (shots // spec['chunk'])
+        if shots % spec['chunk']:
+            sizes.append(shots % spec['chunk'])
+
+        # One unit keeps the point's own seed, several get independent seeds spawned from it
+        if len(sizes) == 1:
+            unit_seeds = [point_seed]
+        else:
+            unit_seeds = [int(child.generate_state(1)[0])
+                          for child in np.random.SeedSequence(point_seed).spawn(len(sizes))]
+
+        result += [(i, j, size, unit_seed) for j, (size, unit_seed) in enumerate(zip(sizes, unit_seeds))]
+
+    return result
+
+
+def shard_path(directory, shard):
+    return Path(directory) / f"shard-{shard:04d}.npz"
+
+
+# The folder the units of an unfinished shard are saved in, one file per unit
+def units_dir(directory, shard):
+    return Path(directory) / f"shard-{shard:04d}"
+
+
+# Function to run every unit of one shard and save their counts
+# The units are dealt out in turn, so every shard gets a mix of small and large points
+# Every unit is saved as soon as it's done, so a shard that's stopped only runs its missing units again
+# Once every unit is done they're combined into the shard's file, and a finished shard isn't run again
+def run_shard(directory, shard, threads=None):
+    spec = load_spec(directory)
+    if not 0 <= shard < spec['shards']:
+        raise ValueError(f"Shard {shard} doesn't exist, {directory} has shards 0 to {spec['shards'] - 1}")
+
+    path = shard_path(directory, shard)
+    if path.exists():
+        print(f"Shard {shard} is already done")
+        return
+
+    mine = units(spec)[shard::spec['shards']]
+    options = {} if threads is None else {'max_parallel_threads': threads}
+    folder = units_dir(directory, shard)
+    folder.mkdir(exist_ok=True)
+
+    counts = np.zeros((len(mine), 4, 4), dtype=np.int64)
+    for k, (point, unit, shots, seed) in enumerate(mine):
+        unit_path = folder / f"unit-{k:06d}.npy"
+        if unit_path.exists():
+            counts[k] = np.load(unit_path)
+            continue
+
+        counts[k] = Counts.to_array(Aer_Qasm.run(shots, sampler=spec['sampler'], seed=seed,
+                                                 noise=spec['noise'], **options))
+        write_array(unit_path, counts[k])
+        print(f"Shard {shard}: unit {k + 1} of {len(mine)} done ({shots} shots)")
+
+    # Write to a temporary file first, so a shard file is either complete or missing
+    # (np.savez adds .npz to names that don't end in it)
+    temporary = path.with_name(f"{path.stem}.{os.getpid()}.tmp.npz")
+    np.savez(temporary, point=np.array([u[0] for u in mine], dtype=np.int64),
+             unit=np.array([u[1] for u in mine], dtype=np.int64), counts=counts)
+    os.replace(temporary, path)
+
+    shutil.rmtree(folder)
+
+
+# Function to save an array so the file is either complete or missing
+def write_array(path, array):
+    temporary = path.with_name(f"{path.stem}.{os.getpid()}.tmp")
+    with open(temporary, "wb") as file:
+        np.save(file, array)
+    os.replace(temporary, path)
+
+
+# Function to run every shard on this machine, processes at a time
+def run_local(directory, processes=None):
+    spec = load_spec(directory)
+    cores = os.cpu_count() or 1
+    processes = processes or min(cores, spec['shards'])
+    threads = max(1, cores // processes)
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = [executor.submit(run_shard, directory, shard, threads) for shard in range(spec['shards'])]
+        for future in futures:
+            future.result()
+
+
+# Function to add the counts of every shard together
+# Returns the (points, 4, 4) counts of the whole sweep and the shots of every point
+def merge(directory):
+    spec = load_spec(directory)
+    points, shot_list, seeds = Data.grid(spec['exponents'], spec['repetitions'], spec['seed'])
+
+    missing = [shard for shard in range(spec['shards']) if not shard_path(directory, shard).exists()]
+    if missing:
+        raise FileNotFoundError(f"Shards {missing} of {directory} haven't finished yet")
+
+    counts = np.zeros((len(points), 4, 4), dtype=np.int64)
+    done = 0
+    for shard in range(spec['shards']):
+        with np.load(shard_path(directory, shard)) as data:
+            # np.add.at adds every unit onto its point, even when a point appears more than once
+            np.add.at(counts, data['point'], data['counts'])
+            done += len(data['point'])
+
+    if done != len(units(spec)):
+        raise ValueError(f"Expected {len(units(spec))} units in {directory}, found {done}")
+
+    return counts, shot_list
+
+
+parser = argparse.ArgumentParser(
+    description="Run a CHSH shot-count sweep in shards, on one or many machines"
+)
+commands = parser.add_subparsers(dest="command", required=True)
+
+plan_parser = commands.add_parser("plan", help="Describe a sweep and split it into shards")
+plan_parser.add_argument("directory", help="Shared directory for the sweep")
+plan_parser.add_argument("--shards", type=int, required=True, help="Number of shards")
+plan_parser.add_argument("--min-exponent", type=int, default=20, help="Smallest shot count is 2^this (default: 20)")
+plan_parser.add_argument("--max-exponent", type=int, default=29, help="Largest shot count is 2^this (default: 29)")
+plan_parser.add_argument("--repetitions", "-r", type=int, default=1, help="Runs per shot count (default: 1)")
+plan_parser.add_argument("--seed", type=int, default=None, help="Seed for the whole sweep (default: a random one)")
+plan_parser.add_argument("--sampler", action="store_true", help="Draw the counts instead of simulating")
+plan_parser.add_argument("--noise", "-n", type=Noise.parse, default=None, help="Noise model, see Noise.py")
+plan_parser.add_argument("--chunk", type=int, default=2**24, help="Most shots in one unit of work (default: 2^24)")
+
+run_parser = commands.add_parser("run", help="Run one shard")
+run_parser.add_argument("directory", help="Shared directory for the sweep")
+run_parser.add_argument("--shard", type=int, required=True, help="Which shard to run, from 0")
+run_parser.add_argument("--threads", type=int, default=None, help="Aer threads (default: every core)")
+
+local_parser = commands.add_parser("local", help="Run every shard on this machine")
+local_parser.add_argument("directory", help="Shared directory for the sweep")
+local_parser.add_argument("--processes", "-p", type=int, default=None, help="Shards at a time (default: one per core)")
+
+merge_parser = commands.add_parser("merge", help="Add up the shards, print S and plot it")
+merge_parser.add_argument("directory", help="Shared directory for the sweep")
+merge_parser.add_argument("--filename", "-f", default="figure.png", help="Name of the plot saved in plots/")
+
+
+def main(argv=None):
+    args = parser.parse_args(argv)
+
+    if args.command == "plan":
+        spec = plan(args.directory, args.shards, range(args.min_exponent, args.max_exponent + 1),
+                    args.repetitions, args.seed, args.sampler, args.noise, args.chunk)
+        print(f"{len(units(spec))} units over {args.shards} shards, saved to {args.directory}")
+
+    elif args.command == "run":
+        run_shard(args.directory, args.shard, args.threads)
+
+    elif args.command == "local":
+        run_local(args.directory, args.processes)
+
+    else:
+        counts, shots = merge(args.directory)
+        values = Counts.S(counts).tolist()
+        errors = Counts.standard_error(counts).tolist()
+
+        for iterator, (S, error, shot_count) in enumerate(zip(values, errors, shots), start=1):
+            print(f"{iterator}: S = {S} ± {error:.2e}; shots = {shot_count}")
+
+        Data.plot(values, shots, args.filename, errors)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+from statistics import NormalDist
+import numpy as np
+import Counts
+
+# How sure can we be that S really is above 2, from a single run?
+#
+# Running the same experiment 6 times shows the spread of S, but costs 6 runs and 6 values
+#   are too few to say much about the tails. One run's counts already say how much S can vary:
+#
+#   - Analytic: every shot is ±1, so E has variance (1 - E^2)/N and the four independent
+#     settings add up to the variance of S (see Counts.standard_error)
+#   - Bootstrap: new counts are drawn from the measured outcome frequencies, with the same number
+#     of shots, many times over, and S is calculated for every draw. The spread of those S values
+#     is the spread of S, without assuming it's normally distributed.
+#
+# Both give a confidence interval for S, and a p-value for S being at most 2 (the local
+#   hidden-variable bound), i.e. the chance of measuring an S this high if the bound held.
+#
+# Every function works on one run, a (4 settings, 4 outcomes) counts array, or on many runs
+#   at once with any number of leading axes, i.e. a whole sweep of (n, 4, 4).
+
+
+# The largest S a local hidden-variable theory allows
+bound = 2
+
+
+def z_value(confidence):
+    return NormalDist().inv_cdf(0.5 + confidence / 2)
+
+
+# Function to return the (lower, upper) normal confidence interval of S
+def interval(array, confidence=0.95):
+    S = Counts.S(array)
+    half_width = z_value(confidence) * Counts.standard_error(array)
+    return S - half_width, S + half_width
+
+
+# Function to return the one-sided p-value of S against the bound, from the normal approximation
+# Very large violations give a p-value of 0, it's smaller than a float can hold
+def p_value(array):
+    z = (Counts.S(array) - bound) / Counts.standard_error(array)
+    return 1 - np.vectorize(NormalDist().cdf)(z)
+
+
+# Function to return resamples values of S drawn by the bootstrap
+# The output has shape (resamples, leading axes of array), i.e. (resamples,) for one run
+# The draws are done chunk resamples at a time so millions of them never need all their counts in memory
+def bootstrap(array, resamples=1000000, seed=None, chunk=None):
+    array = np.asarray(array)
+    rng = np.random.default_rng(seed)
+
+    # The shots and measured outcome frequencies of every setting of every run
+    shots = array.sum(axis=-1)
+    frequencies = array / shots[..., None]
+
+    # Keep every chunk of draws at around 64 MB
+    if chunk is None:
+        chunk = max(1, 2**23 // array.size)
+
+    samples = np.empty((resamples,) + array.shape[:-2])
+    for start in range(0, resamples, chunk):
+        size = min(chunk, resamples - start)
+
+        # One multinomial draw per setting per resample, all at once
+        draws = rng.multinomial(shots, frequencies, size=(size,) + shots.shape)
+        samples[start:start + size] = Counts.S(draws)
+
+    return samples
+
+
+# Function to return the (lower, upper) percentile confidence interval from bootstrap samples
+def bootstrap_interval(samples, confidence=0.95):
+    lower, upper = np.quantile(samples, [0.5 - confidence / 2, 0.5 + confidence / 2], axis=0)
+    return lower, upper
+
+
+# Function to return the one-sided p-value of S against the bound from bootstrap samples
+# The samples are shifted to be centred on the bound, and the p-value is how often they reach S
+# It can't be smaller than 1/(resamples + 1), more resamples are needed to show smaller p-values
+def bootstrap_p_value(samples, S):
+    exceed = np.sum(samples - S >= S - bound, axis=0)
+    return (exceed + 1) / (len(samples) + 1)
+
+
+# Function to return all of the above for one run as a dictionary
+def summary(array, confidence=0.95, resamples=100000, seed=None):
+    array = np.asarray(array)
+    S = float(Counts.S(array))
+    samples = bootstrap(array, resamples, seed)
+
+    return {
+        'S': S,
+        'standard_error': float(Counts.standard_error(array)),
+        'confidence': confidence,
+        'interval': [float(x) for x in interval(array, confidence)],
+        'p_value': float(p_value(array)),
+        'bootstrap_standard_error': float(np.std(samples, ddof=1)),
+        'bootstrap_interval': [float(x) for x in bootstrap_interval(samples, confidence)],
+        'bootstrap_p_value': float(bootstrap_p_value(samples, S)),
+        'resamples': resamples,
+    }
@@ -0,0 +1,112 @@
+import json
+import os
+from pathlib import Path
+import numpy as np
+
+# This program saves the results of a sweep to disk as they come in, one run at a time.
+#
+# Every column (i.e. shots, S, ...) is its own binary file that new rows are added to the end of,
+#   and index.json records how many rows are complete. A run is only counted once it's in the index,
+#   so if the program crashes halfway through writing a run, that run is simply done again.
+#
+# Reading a column memory-maps its file, so it behaves like a NumPy array without loading
+#   the whole file into memory.
+#
+# i.e.
+#   store = Store("sweeps/run1", columns={"shots": ("int64", ()), "S": ("float64", ())})
+#   store.append(shots=1024, S=2.81)
+#   store.column("S")   -> array([2.81])
+#
+# The settings the rows were made with (i.e. the noise model) are kept in index.json as well,
+#   so rows made with other settings aren't mixed in by mistake, see check_settings
+
+
+class Store:
+
+    # columns maps every column name to its (dtype, shape of one row), i.e. ("int64", (4, 4))
+    # It's only needed the first time, after that the columns are read from index.json
+    def __init__(self, path, columns=None):
+        self.path = Path(path)
+        self.index_path = self.path / "index.json"
+
+        if self.index_path.exists():
+            with open(self.index_path) as file:
+                index = json.load(file)
+            self.columns = {name: (dtype, tuple(shape)) for name, (dtype, shape) in index["columns"].items()}
+            self.rows = index["rows"]
+            self.settings = index.get("settings")
+        elif columns is None:
+            raise FileNotFoundError(f"No store at {self.path} and no columns to make one with")
+        else:
+            self.path.mkdir(parents=True, exist_ok=True)
+            self.columns = {name: (np.dtype(dtype).str, tuple(shape)) for name, (dtype, shape) in columns.items()}
+            self.rows = 0
+            self.settings = None
+            self.write_index()
+
+    def __len__(self):
+        return self.rows
+
+    def column_path(self, name):
+        return self.path / f"{name}.bin"
+
+    def row_size(self, name):
+        dtype, shape = self.columns[name]
+        return np.dtype(dtype).itemsize * int(np.prod(shape, dtype=np.int64))
+
+    # Rename a finished temporary file over the old index, so the index is never half written
+    def write_index(self):
+        index = {"rows": self.rows,
+                 "columns": {name: [dtype, list(shape)] for name, (dtype, shape) in self.columns.items()},
+                 "settings": self.settings}
+        temporary = self.index_path.with_suffix(".tmp")
+        with open(temporary, "w") as file:
+            json.dump(index, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, self.index_path)
+
+    # Function to refuse a store whose rows were made with other settings than these
+    # settings is anything JSON can hold, i.e. {"sampler": False, "noise": {"depolarizing": 0.01}}
+    # A store that has no settings yet takes these
+    def check_settings(self, settings):
+        # Compare them the way they come back from index.json, i.e. tuples as lists
+        settings = json.loads(json.dumps(settings))
+
+        if self.settings is None:
+            self.settings = settings
+            self.write_index()
+        elif self.settings != settings:
+            raise ValueError(f"The store at {self.path} was made with {self.settings}, not {settings}")
+
+    # Function to add one row, with a value for every column
+    # The row is on disk when this returns
+    def append(self, **values):
+
+        if set(values) != set(self.columns):
+            raise ValueError(f"Expected values for {sorted(self.columns)}, got {sorted(values)}")
+
+        for name, (dtype, shape) in self.columns.items():
+            value = np.asarray(values[name], dtype=dtype)
+            if value.shape != shape:
+                raise ValueError(f"{name} should have shape {shape}, got {value.shape}")
+
+            with open(self.column_path(name), "ab") as file:
+                # Cut off anything left behind by a crash after the last complete row
+                file.truncate(self.rows * self.row_size(name))
+                file.write(value.tobytes())
+                file.flush()
+                os.fsync(file.fileno())
+
+        # Only now does the row count as done
+        self.rows += 1
+        self.write_index()
+
+    # Function to return a column as a read-only memory-mapped array
+    def column(self, name):
+        dtype, shape = self.columns[name]
+
+        if self.rows == 0:
+            return np.empty((0,) + shape, dtype=dtype)
+
+        return np.memmap(self.column_path(name), dtype=dtype, mode="r", shape=(self.rows,) + shape)
@@ -0,0 +1,119 @@
+import contextlib
+import cProfile
+import json
+import pstats
+import time
+import tracemalloc
+
+# This program measures where the time goes inside a CHSH run.
+#
+# A Report collects the wall time (real time passed) and CPU time (time this process spent
+#   computing) of every phase of a run, i.e. building the circuits, transpiling, running the
+#   simulator, reading the counts and calculating E. Phases that are done once per measurement
+#   setting are timed per setting.
+#
+# i.e.
+#   report = Report()
+#   with report.phase("transpile"):
+#       ...
+#   report.to_dict()
+#
+# On request it can also run cProfile (time spent in every Python function) and
+#   tracemalloc (peak Python memory) over the whole run. Both slow the run down, so they're off by default.
+# tracemalloc only sees memory allocated by Python, not memory allocated inside the Aer simulator.
+
+
+class Report:
+
+    def __init__(self, profile=False, memory=False):
+        self.phases = []
+        self.profile = cProfile.Profile() if profile else None
+        self.memory = memory
+        self.peak = None
+
+    # Function to time the code inside a `with` block as one phase
+    # setting is the measurement setting it belongs to, i.e. "A0B1", or None for all of them
+    @contextlib.contextmanager
+    def phase(self, name, setting=None):
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            self.phases.append({
+                "phase": name,
+                "setting": setting,
+                "wall": time.perf_counter() - wall,
+                "cpu": time.process_time() - cpu,
+            })
+
+    # Turns on cProfile and tracemalloc, if they were asked for
+    def start(self):
+        if self.memory:
+            tracemalloc.start()
+        if self.profile is not None:
+            self.profile.enable()
+
+    def stop(self):
+        if self.profile is not None:
+            self.profile.disable()
+        if self.memory:
+            current, self.peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+    # Function to return the slowest functions found by cProfile, by total time spent inside them
+    def hotspots(self, limit=20):
+        stats = pstats.Stats(self.profile).stats
+        rows = []
+        for (filename, line, function), (calls, _, own, cumulative, _) in stats.items():
+            rows.append({
+                "function": f"{filename}:{line}({function})",
+                "calls": calls,
+                "own": own,
+                "cumulative": cumulative,
+            })
+        rows.sort(key=lambda row: row["cumulative"], reverse=True)
+        return rows[:limit]
+
+    def to_dict(self):
+        report = {"phases": self.phases, "totals": totals(self.phases)}
+        if self.profile is not None:
+            report["profile"] = self.hotspots()
+        if self.peak is not None:
+            report["memory"] = {"peak": self.peak}
+        return report
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2)
+
+
+# Function to add up the wall and CPU time of every phase, over all settings
+def totals(phases):
+    result = {}
+    for phase in phases:
+        total = result.setdefault(phase["phase"], {"wall": 0.0, "cpu": 0.0, "count": 0})
+        total["wall"] += phase["wall"]
+        total["cpu"] += phase["cpu"]
+        total["count"] += 1
+    return result
+
+
+# Function to time a phase only when there is a report to put it in
+# i.e. `with Timing.phase(report, "transpile"):` works the same when report is None
+def phase(report, name, setting=None):
+    if report is None:
+        return contextlib.nullcontext()
+    return report.phase(name, setting)
+
+
+# Function to combine the reports of many runs (i.e. a whole sweep) into one
+# reports are the dictionaries from Report.to_dict()
+def aggregate(reports):
+    phases = [phase for report in reports for phase in report["phases"]]
+    summary = {"runs": len(reports), "totals": totals(phases)}
+
+    peaks = [report["memory"]["peak"] for report in reports if "memory" in report]
+    if peaks:
+        summary["memory"] = {"peak": max(peaks)}
+
+    return summary
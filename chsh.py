@@ -0,0 +1,71 @@
+import argparse
+import Aer_StateVector
+import Aer_Qasm
+import Data
+import CHSH_Experiment
+
+# One command line program for everything in this repository
+#
+# i.e.
+#   python chsh.py statevector
+#   python chsh.py qasm --shots 1048576
+#   python chsh.py sweep --workers 8 --seed 1
+#   python chsh.py plot --seed 1
+#   python chsh.py hardware --token YOUR_TOKEN_HERE
+#
+# None of the programs import Qiskit or matplotlib until they actually need them,
+#   so `python chsh.py --help` (or a typo) answers right away.
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="chsh",
+        description="Violation of the CHSH inequality with Qiskit"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    statevector = commands.add_parser(
+        "statevector",
+        help="Noiseless statevector simulation (Aer_StateVector.py)"
+    )
+    Aer_StateVector.add_arguments(statevector)
+    statevector.set_defaults(function=Aer_StateVector.command)
+
+    qasm = commands.add_parser(
+        "qasm",
+        help="Shot based simulation, optionally with noise (Aer_Qasm.py)"
+    )
+    Aer_Qasm.add_arguments(qasm)
+    qasm.set_defaults(function=Aer_Qasm.command)
+
+    sweep = commands.add_parser(
+        "sweep",
+        help="Run the shot-count sweep and plot it (Data.py)"
+    )
+    Data.add_arguments(sweep)
+    sweep.set_defaults(function=Data.command)
+
+    plot = commands.add_parser(
+        "plot",
+        help="Re-plot a sweep from the cache without running anything"
+    )
+    Data.add_plot_arguments(plot)
+    plot.set_defaults(function=Data.plot_command)
+
+    hardware = commands.add_parser(
+        "hardware",
+        help="Run on IBM Quantum hardware (CHSH_Experiment.py)"
+    )
+    CHSH_Experiment.add_arguments(hardware)
+    hardware.set_defaults(function=CHSH_Experiment.command)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.function(args)
+
+
+if __name__ == "__main__":
+    main()
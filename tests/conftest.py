@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The programs are plain modules in the repository root, so the tests import them from there
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+# The exact S with noise comes from one density matrix run, so these need Qiskit Aer
+pytest.importorskip("qiskit_aer", exc_type=ImportError)
+
+import Aer_Qasm
+import Exact
+
+
+depolarizing = {'depolarizing': 0.02}
+
+
+def test_optimized_angles_are_never_worse_than_the_defaults():
+    best = Aer_Qasm.optimize(depolarizing, seed=1)
+
+    assert best['S'] >= Aer_Qasm.exact(depolarizing) - 1e-12
+    # The S that's returned is the exact one of the returned angles, not the model's
+    assert best['S'] == pytest.approx(Aer_Qasm.exact_with(best, depolarizing), abs=1e-12)
+
+
+def test_worse_angles_are_improved(monkeypatch):
+    for name, angle in {'A0': 1.2, 'A1': 0.3, 'B0': 0.5, 'B1': -1.1}.items():
+        monkeypatch.setitem(Aer_Qasm.angles, name, angle)
+
+    before = Aer_Qasm.exact(depolarizing)
+    best = Aer_Qasm.optimize(depolarizing, seed=1)
+
+    assert best['S'] > before + 0.1
+    # Only the returned dictionary has the new angles
+    assert Aer_Qasm.angles['A0'] == 1.2
+
+
+def test_start_is_one_of_the_restarts():
+    start = {'A0': np.pi / 2, 'A1': 0, 'B0': np.pi / 4, 'B1': -np.pi / 4}
+    # With no steps the restarts stay where they started, so only the start can give 2√2
+    best = Exact.optimize(steps=0, restarts=4, seed=1, start=start)
+    assert best['S'] == pytest.approx(2 * np.sqrt(2))
@@ -0,0 +1,77 @@
+from collections import Counter
+import numpy as np
+import pytest
+import Counts
+import Recording
+
+# The recordings here are drawn with the sampler, which only needs NumPy
+
+
+@pytest.fixture(scope="module")
+def recording(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("recording")
+    # An odd number of shots, so the last byte is only partly used
+    Recording.record(directory, 50003, sampler=True, seed=1, chunk=4096)
+    return directory
+
+
+# Function to count the outcomes of shots start to stop of every setting the slow way,
+#   one bitstring at a time through Counts.to_array
+def unpacked_counts(directory, start, stop):
+    counts = []
+    for setting in range(4):
+        outcomes = Recording.outcomes(directory, setting, start, stop)
+        counts.append(dict(Counter(Counts.outcomes[outcome] for outcome in outcomes)))
+    return Counts.to_array(counts)
+
+
+def test_pack_round_trip():
+    outcomes = np.random.default_rng(0).integers(0, 4, (4, 1001), dtype=np.uint8)
+    packed = Recording.pack(outcomes)
+    assert packed.shape == (4, 251)
+    assert np.array_equal(Recording.unpack(packed)[:, :1001], outcomes)
+
+
+@pytest.mark.parametrize("window", [4, 100, 1020, 1024, 4100])
+@pytest.mark.parametrize("block_bytes", [333, 2**21])
+def test_window_counts_match_unpacked(recording, window, block_bytes):
+    # Windows of 1024 shots or more use the histogram path, shorter ones the lookup table path,
+    #   and the small blocks make windows run over the edge of a block
+    counts = Recording.window_counts(recording, window, block_bytes)
+    assert counts.shape == (50003 // window, 4, 4)
+
+    for i in [0, 1, len(counts) // 2, len(counts) - 1]:
+        assert np.array_equal(counts[i], unpacked_counts(recording, i * window, (i + 1) * window))
+
+
+def test_windows_add_up_to_the_whole_recording(recording):
+    assert np.array_equal(Recording.window_counts(recording, 400).sum(axis=0),
+                          unpacked_counts(recording, 0, 50000))
+    assert np.array_equal(Recording.counts(recording), unpacked_counts(recording, 0, 50003))
+    assert Recording.counts(recording).sum() == 4 * 50003
+
+
+def test_window_has_to_start_on_a_byte(recording):
+    with pytest.raises(ValueError):
+        Recording.window_counts(recording, 1001)
+
+
+def test_stopped_recording_carries_on_with_the_same_outcomes(recording, tmp_path):
+    Recording.record(tmp_path, 50003, sampler=True, seed=1, chunk=4096)
+
+    # Pretend it stopped after three chunks
+    spec = Recording.load_spec(tmp_path)
+    spec['recorded'] = 3 * 4096
+    Recording.write_spec(tmp_path, spec)
+
+    Recording.record(tmp_path, 50003, sampler=True, chunk=4096)
+    assert np.array_equal(Recording.load(tmp_path)[1], Recording.load(recording)[1])
+
+
+def test_different_recording_is_not_overwritten(tmp_path):
+    Recording.record(tmp_path, 1000, sampler=True, seed=1)
+    with pytest.raises(FileExistsError):
+        Recording.record(tmp_path, 2000, sampler=True, seed=1)
+
+    Recording.record(tmp_path, 2000, sampler=True, seed=1, overwrite=True)
+    assert Recording.load_spec(tmp_path)['shots'] == 2000
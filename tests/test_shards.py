@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+import Aer_Qasm
+import Counts
+import Shards
+
+# The units are run by a stand-in for Aer_Qasm.run, so no Qiskit (or cache) is involved
+
+
+# Stand-in for Aer_Qasm.run that makes up counts from the seed
+def fake_run(shots, sampler=False, seed=None, noise=None, **options):
+    return Counts.to_dicts(np.random.default_rng(seed).multinomial(shots, [0.4, 0.1, 0.1, 0.4], size=4))
+
+
+@pytest.fixture
+def sweep(tmp_path, monkeypatch):
+    monkeypatch.setattr(Aer_Qasm, 'run', fake_run)
+    # Points of 2^10 to 2^13 shots in units of at most 2^11, so the larger points are split up
+    Shards.plan(tmp_path, 3, range(10, 14), repetitions=2, seed=1, sampler=True, chunk=2**11)
+    return tmp_path
+
+
+def test_merge_adds_up_every_unit_of_every_point(sweep):
+    for shard in range(3):
+        Shards.run_shard(sweep, shard)
+
+    counts, shots = Shards.merge(sweep)
+
+    # Every unit of every point, added up one at a time
+    spec = Shards.load_spec(sweep)
+    expected = np.zeros((8, 4, 4), dtype=np.int64)
+    for point, unit, unit_shots, seed in Shards.units(spec):
+        expected[point] += Counts.to_array(fake_run(unit_shots, seed=seed))
+
+    assert np.array_equal(counts, expected)
+    assert counts.sum(axis=-1).tolist() == [[shot_count] * 4 for shot_count in shots]
+    assert shots == [2**exponent for exponent in range(10, 14) for repetition in range(2)]
+
+
+def test_single_unit_points_keep_the_sweep_seed(sweep):
+    # Points that fit in one unit use the same seed as Data.py would, so they give the same counts
+    points, shot_list, seeds = Shards.Data.grid(range(10, 14), 2, seed=1)
+    for shard in range(3):
+        Shards.run_shard(sweep, shard)
+
+    counts, shots = Shards.merge(sweep)
+    for i, (shot_count, seed) in enumerate(zip(shot_list, seeds)):
+        if shot_count <= 2**11:
+            assert np.array_equal(counts[i], Counts.to_array(fake_run(shot_count, seed=seed)))
+
+
+def test_merge_waits_for_every_shard(sweep):
+    Shards.run_shard(sweep, 0)
+    with pytest.raises(FileNotFoundError):
+        Shards.merge(sweep)
+
+
+def test_stopped_shard_only_runs_its_missing_units(sweep, monkeypatch):
+    calls = []
+
+    def crashing_run(shots, seed=None, **options):
+        calls.append(seed)
+        if len(calls) == 3:
+            raise RuntimeError("stopped")
+        return fake_run(shots, seed=seed, **options)
+
+    monkeypatch.setattr(Aer_Qasm, 'run', crashing_run)
+    with pytest.raises(RuntimeError):
+        Shards.run_shard(sweep, 0)
+
+    # The two units that finished are kept, the rest run the second time
+    def counting_run(shots, seed=None, **options):
+        calls.append(seed)
+        return fake_run(shots, seed=seed, **options)
+
+    calls.clear()
+    monkeypatch.setattr(Aer_Qasm, 'run', counting_run)
+    Shards.run_shard(sweep, 0)
+
+    mine = Shards.units(Shards.load_spec(sweep))[0::3]
+    assert calls == [seed for point, unit, shots, seed in mine[2:]]
+    assert not Shards.units_dir(sweep, 0).exists()
+
+
+def test_shard_has_to_exist(sweep):
+    with pytest.raises(ValueError):
+        Shards.run_shard(sweep, 3)
+    assert not Shards.shard_path(sweep, 3).exists()
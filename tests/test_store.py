@@ -0,0 +1,130 @@
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pytest
+import Counts
+import Data
+from Store import Store
+
+# None of these need Qiskit: the store is plain NumPy, and the sweep's runs are replaced by a stand-in
+
+
+columns = {'shots': ('int64', ()), 'counts': ('int64', (4, 4)), 'S': ('float64', ())}
+
+
+def row(i):
+    return {'shots': 2**i, 'counts': np.full((4, 4), i), 'S': 2 + i / 10}
+
+
+def test_rows_survive_reopening(tmp_path):
+    store = Store(tmp_path, columns)
+    for i in range(3):
+        store.append(**row(i))
+
+    store = Store(tmp_path)
+    assert len(store) == 3
+    assert store.column('shots').tolist() == [1, 2, 4]
+    assert np.array_equal(store.column('counts')[2], np.full((4, 4), 2))
+
+
+def test_half_written_row_is_cut_off(tmp_path):
+    store = Store(tmp_path, columns)
+    store.append(**row(0))
+    store.append(**row(1))
+
+    # A crash after writing part of a third row, before the index was updated
+    with open(store.column_path('S'), 'ab') as file:
+        file.write(b'\x01\x02\x03')
+    with open(store.column_path('shots'), 'ab') as file:
+        file.write(np.int64(99).tobytes())
+
+    store = Store(tmp_path)
+    assert len(store) == 2
+    assert store.column('S').tolist() == [2.0, 2.1]
+
+    # The leftovers are cut off before the next row is written
+    store.append(**row(5))
+    assert store.column('shots').tolist() == [1, 2, 32]
+    assert store.column('S').tolist() == [2.0, 2.1, 2.5]
+    assert store.column_path('S').stat().st_size == 3 * 8
+
+
+def test_wrong_columns_are_refused(tmp_path):
+    store = Store(tmp_path, columns)
+    with pytest.raises(ValueError):
+        store.append(shots=1, S=2.0)
+    with pytest.raises(ValueError):
+        store.append(shots=1, counts=np.zeros(4), S=2.0)
+    assert len(store) == 0
+
+
+# Stand-in for Data.task that makes up counts from the seed instead of simulating
+def fake_task(shots, seed, threads, sampler, noise, timing=False, profile=False, cache=True):
+    counts = np.random.default_rng(seed).multinomial(shots, [0.4, 0.1, 0.1, 0.4], size=4)
+    return counts, float(Counts.S(counts)), 0.0, None
+
+
+def test_sweep_skips_stored_runs(tmp_path, monkeypatch):
+    ran = []
+
+    def task(shots, seed, *args):
+        ran.append(seed)
+        return fake_task(shots, seed, *args)
+
+    # Threads instead of processes, so the stand-in is used
+    monkeypatch.setattr(Data, 'ProcessPoolExecutor', ThreadPoolExecutor)
+    monkeypatch.setattr(Data, 'task', task)
+
+    points, shot_list, seeds = Data.grid(range(4, 7), 2, seed=3)
+
+    # The first sweep stops (crashes) after three runs
+    store = Data.open_store(tmp_path)
+    for i in range(3):
+        counts, S, seconds, report = fake_task(shot_list[i], seeds[i], 1, False, None)
+        Data.save(store, points[i], shot_list[i], seeds[i], counts, S, seconds)
+
+    # Running it again only runs the other three, and every result ends up in its own place
+    # seed=None keeps the cache out of it, so only the store can skip runs
+    values, shots, errors = Data.DataCollection(range(4, 7), 2, workers=2, seed=None,
+                                                store=Data.open_store(tmp_path))
+
+    # Without a seed the new runs get other seeds, so they're recognised by what was asked for
+    assert len(ran) == 3
+    assert shots == shot_list
+    for i in range(3):
+        assert values[i] == fake_task(shot_list[i], seeds[i], 1, False, None)[1]
+    assert len(Data.open_store(tmp_path)) == 6
+
+    # A third time there's nothing left to run
+    ran.clear()
+    again, _, _ = Data.DataCollection(range(4, 7), 2, workers=2, store=Data.open_store(tmp_path))
+    assert ran == []
+    assert again == values
+
+
+def test_settings_survive_reopening_and_others_are_refused(tmp_path):
+    store = Store(tmp_path, columns)
+    store.check_settings({'sampler': True, 'noise': {'readout': 0.02}})
+
+    store = Store(tmp_path)
+    store.check_settings({'sampler': True, 'noise': {'readout': 0.02}})
+    with pytest.raises(ValueError):
+        store.check_settings({'sampler': True, 'noise': None})
+
+
+def test_sweep_refuses_a_store_made_differently(tmp_path, monkeypatch):
+    monkeypatch.setattr(Data, 'ProcessPoolExecutor', ThreadPoolExecutor)
+    monkeypatch.setattr(Data, 'task', fake_task)
+
+    Data.DataCollection(range(4, 6), 1, workers=1, seed=3, store=Data.open_store(tmp_path))
+
+    # Another seed gives the same (exponent, repetition) pairs, but other runs
+    with pytest.raises(ValueError):
+        Data.DataCollection(range(4, 6), 1, workers=1, seed=4, store=Data.open_store(tmp_path))
+    with pytest.raises(ValueError):
+        Data.DataCollection(range(4, 6), 1, workers=1, seed=3, noise={'readout': 0.02},
+                            store=Data.open_store(tmp_path))
+    with pytest.raises(ValueError):
+        Data.DataCollection(range(4, 6), 1, workers=1, seed=3, sampler=True, store=Data.open_store(tmp_path))
+
+    # Nothing was added by the refused sweeps
+    assert len(Data.open_store(tmp_path)) == 2